@@ -1,87 +1,189 @@
 import os
-import subprocess
+import sys
+import json
+import time
 import shutil
-from dagster import op, job, schedule, get_dagster_logger, In, Out, ConfigurableResource
+from contextlib import contextmanager
+from datetime import date, timedelta, timezone
+from dagster import (
+    op, graph, schedule, get_dagster_logger, In, Nothing, ConfigurableResource, Definitions, multiprocess_executor,
+    DailyPartitionsDefinition, StaticPartitionsDefinition, MultiPartitionsDefinition, MultiPartitionKey, RunRequest
+)
 
 logger = get_dagster_logger()
 
-# -------- Dagster ConfigurableResource Example --------
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# -------- PARTITIONS --------
+
+# Keep in sync with TELEGRAM_CHANNELS in src/scraping/scrape_telegram.py
+PIPELINE_CHANNELS = ["CheMed123", "lobelia4cosmetics", "tikvahpharma"]
+PARTITIONS_START_DATE = os.getenv("PIPELINE_PARTITIONS_START_DATE", "2024-01-01")
+
+# One partition per data/raw/telegram_messages/<date>/<channel>/ directory
+telegram_partitions = MultiPartitionsDefinition({
+    "date": DailyPartitionsDefinition(start_date=PARTITIONS_START_DATE),
+    "channel": StaticPartitionsDefinition(PIPELINE_CHANNELS),
+})
+
+# Partition runs only build the incremental models that filter on the partition vars, so concurrent
+# runs for different partitions each delete+insert their own rows. The dimensions, the
+# stg_telegram_images view and first-time (non-incremental) builds come from the unpartitioned job,
+# which has to have run once before partitions are backfilled (and again after adding a channel).
+STAGING_PARTITION_MODELS = ["stg_telegram_messages"]
+MARTS_PARTITION_MODELS = ["fct_messages", "fct_image_detections", "agg_channel_daily_activity"]
+
+# -------- Dagster ConfigurableResource --------
 class PipelineConfig(ConfigurableResource):
-    scraper_script: str
-    loader_script: str
-    dbt_project_dir: str
-    yolo_script: str
+    project_root: str = PROJECT_ROOT  # working directory for the relative data/ paths used by the scripts
+    dbt_project_dir: str = os.path.join(PROJECT_ROOT, "medical_telegram_dbt")
+    full_reload: bool = False  # loaders ignore their load manifests
 
-# -------- OPS --------
+# -------- HELPERS --------
 
-@op(config_schema={"script_path": str})
-def scrape_telegram_data(context):
-    script_path = context.op_config["script_path"]
-    logger.info(f"Starting Telegram scraping using: {script_path}")
-    try:
-        subprocess.run(["python", script_path], check=True, cwd=os.path.dirname(script_path))
-        logger.info("✅ Telegram data scraping completed successfully.")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"❌ Error during Telegram scraping: {e}")
-        raise
+def call_pipeline_function(pipeline_config, relative_dir, module_name, function_name, *args, **kwargs):
+    """
+    Calls a function of one of the pipeline scripts in the op's own process (coroutines are run to
+    completion), so no extra interpreter is started and nothing is imported twice. The working
+    directory is set to project_root, where the scripts' relative data/ paths resolve; the jobs use
+    multiprocess_executor, so every op has its process to itself and no other op sees the change.
+    """
+    os.chdir(pipeline_config.project_root)
+    src_dir = os.path.join(pipeline_config.project_root, "src")
+    if src_dir not in sys.path:
+        sys.path.insert(0, src_dir)
+    import pipeline_step
 
-@op(config_schema={"script_path": str})
-def load_raw_to_postgres(context):
-    script_path = context.op_config["script_path"]
-    logger.info(f"Starting loading data to PostgreSQL using: {script_path}")
-    try:
-        subprocess.run(["python", script_path], check=True, cwd=os.path.dirname(script_path))
-        logger.info("✅ Raw data loading completed successfully.")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"❌ Error loading data to PostgreSQL: {e}")
-        raise
+    return pipeline_step.call(pipeline_config.project_root, relative_dir, module_name, function_name, args, kwargs)
 
-@op(config_schema={"dbt_project_path": str})
-def run_dbt_transformations(context):
-    dbt_project_path = context.op_config["dbt_project_path"]
-    if not shutil.which("dbt"):
-        raise RuntimeError("❌ 'dbt' not found in PATH. Please install dbt.")
-    logger.info(f"Starting dbt run in: {dbt_project_path}")
+@contextmanager
+def timed_step(step_name):
+    logger.info(f"Starting {step_name}...")
+    start = time.monotonic()
     try:
-        subprocess.run(["dbt", "run"], check=True, cwd=dbt_project_path)
-        logger.info("✅ dbt transformations completed successfully.")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"❌ Error during dbt run: {e}")
+        yield
+    except Exception as e:
+        logger.error(f"❌ Error during {step_name} after {time.monotonic() - start:.1f}s: {e}")
         raise
+    logger.info(f"✅ {step_name} completed in {time.monotonic() - start:.1f}s.")
 
-@op(config_schema={"script_path": str})
-def run_yolo_enrichment(context):
-    script_path = context.op_config["script_path"]
-    logger.info(f"Starting YOLO enrichment using: {script_path}")
-    try:
-        subprocess.run(["python", script_path], check=True, cwd=os.path.dirname(script_path))
-        logger.info("✅ YOLO enrichment completed successfully.")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"❌ Error during YOLO enrichment: {e}")
-        raise
+def get_partition(context):
+    """Returns the run's (date, channel) partition, or None for an unpartitioned run."""
+    if not context.has_partition_key:
+        return None
+    keys = context.partition_key.keys_by_dimension
+    return keys["date"], keys["channel"]
 
-# -------- JOB --------
+def run_dbt(context, pipeline_config, args, partition=None):
+    from dbt.cli.main import dbtRunner  # dbt >= 1.5 programmatic invocation
+    if partition:
+        # Incremental models only rebuild this partition's rows
+        args = [*args, "--vars", json.dumps({"partition_date": partition[0], "partition_channel": partition[1]})]
+    # Concurrent partition runs would race on target/'s manifest.json, partial_parse.msgpack and
+    # run_results.json, so each run gets its own target path (kept only if dbt failed)
+    target_path = os.path.join(pipeline_config.dbt_project_dir, "target", context.run_id)
+    result = dbtRunner().invoke([*args, "--project-dir", pipeline_config.dbt_project_dir, "--target-path", target_path])
+    if not result.success:
+        raise RuntimeError(f"dbt {' '.join(args)} failed: {result.exception}")
+    shutil.rmtree(target_path, ignore_errors=True)
 
-@job
-def telegram_pipeline():
-    scrape = scrape_telegram_data()
-    load = load_raw_to_postgres()
-    dbt = run_dbt_transformations()
-    yolo = run_yolo_enrichment()
-    # Simple linear pipeline
-    load.alias("load_after_scrape").after(scrape)
-    dbt.alias("dbt_after_load").after(load)
-    yolo.alias("yolo_after_dbt").after(dbt)
+# -------- OPS --------
+
+@op
+def scrape_telegram_data(context, pipeline_config: PipelineConfig):
+    scraping_dir = os.path.join("src", "scraping")
+    partition = get_partition(context)
+    with timed_step("Telegram scraping" + (f" for {partition[0]}/{partition[1]}" if partition else "")):
+        if partition:
+            call_pipeline_function(
+                pipeline_config, scraping_dir, "scrape_telegram", "scrape_partition",
+                partition[1], date.fromisoformat(partition[0])
+            )
+        else:
+            call_pipeline_function(pipeline_config, scraping_dir, "scrape_telegram", "scrape_once")
+
+@op(ins={"after_scrape": In(Nothing)})
+def load_raw_messages(context, pipeline_config: PipelineConfig):
+    with timed_step("raw message loading"):
+        call_pipeline_function(
+            pipeline_config, "src", "load_raw_messages", "main",
+            full_reload=pipeline_config.full_reload, partition=get_partition(context)
+        )
+
+# Images are registered only when their parent message exists, so this waits for the message load
+@op(ins={"after_messages": In(Nothing)})
+def load_raw_images(context, pipeline_config: PipelineConfig):
+    with timed_step("raw image loading"):
+        call_pipeline_function(
+            pipeline_config, "src", "load_raw_images", "main",
+            full_reload=pipeline_config.full_reload, partition=get_partition(context)
+        )
+
+@op(ins={"after_messages": In(Nothing)})
+def run_dbt_staging(context, pipeline_config: PipelineConfig):
+    partition = get_partition(context)
+    select = STAGING_PARTITION_MODELS if partition else ["path:models/staging"]
+    with timed_step("dbt staging models"):
+        run_dbt(context, pipeline_config, ["run", "--select", *select], partition)
+
+# Detection enqueues straight from raw_telegram_images, so it doesn't wait for dbt
+@op(ins={"after_images": In(Nothing)})
+def run_yolo_enrichment(context, pipeline_config: PipelineConfig):
+    with timed_step("YOLO enrichment"):
+        call_pipeline_function(
+            pipeline_config, "medical_telegram_dbt", "detect_objects", "run", partition=get_partition(context)
+        )
+
+@op(ins={"after_staging": In(Nothing), "after_detection": In(Nothing)})
+def run_dbt_marts(context, pipeline_config: PipelineConfig):
+    partition = get_partition(context)
+    select = MARTS_PARTITION_MODELS if partition else ["path:models/marts"]
+    with timed_step("dbt mart models"):
+        run_dbt(context, pipeline_config, ["run", "--select", *select], partition)
+
+    run_stats = context.instance.get_run_stats(context.run_id)
+    if run_stats.start_time:
+        logger.info(f"⏱️ Pipeline wall-clock time: {time.time() - run_stats.start_time:.1f}s")
+
+# -------- JOBS --------
+
+# Each op runs in its own process, so independent branches run concurrently:
+# scrape -> messages -> { images -> YOLO, dbt staging } -> dbt marts
+@graph
+def telegram_graph():
+    messages = load_raw_messages(scrape_telegram_data())
+    detections = run_yolo_enrichment(load_raw_images(messages))
+    run_dbt_marts(after_staging=run_dbt_staging(messages), after_detection=detections)
+
+# Unpartitioned: scrapes from the channel checkpoints and loads everything new
+telegram_pipeline = telegram_graph.to_job(name="telegram_pipeline", executor_def=multiprocess_executor)
+
+# Partitioned by date x channel: each run only touches its partition's files and rows,
+# so a bad day can be reprocessed alone and backfills fan out one run per partition
+telegram_partitioned_pipeline = telegram_graph.to_job(
+    name="telegram_partitioned_pipeline",
+    executor_def=multiprocess_executor,
+    partitions_def=telegram_partitions,
+)
 
 # -------- SCHEDULE --------
 
-@schedule(cron_schedule="0 2 * * *", job=telegram_pipeline, execution_timezone="Africa/Addis_Ababa")
-def daily_telegram_schedule(_context):
-    return {
-        "ops": {
-            "scrape_telegram_data": {"config": {"script_path": "/absolute/path/to/scraper.py"}},
-            "load_raw_to_postgres": {"config": {"script_path": "/absolute/path/to/loader.py"}},
-            "run_dbt_transformations": {"config": {"dbt_project_path": "/absolute/path/to/dbt_project"}},
-            "run_yolo_enrichment": {"config": {"script_path": "/absolute/path/to/yolo_processor.py"}},
-        }
-    }
\ No newline at end of file
+@schedule(cron_schedule="0 2 * * *", job=telegram_partitioned_pipeline, execution_timezone="Africa/Addis_Ababa")
+def daily_telegram_schedule(context):
+    """Runs the latest complete day's partition for every channel."""
+    # Partitions follow the scraper's UTC message dates
+    now_utc = context.scheduled_execution_time.astimezone(timezone.utc)
+    day = (now_utc.date() - timedelta(days=1)).isoformat()
+    return [
+        RunRequest(
+            run_key=f"{day}|{channel}",
+            partition_key=MultiPartitionKey({"date": day, "channel": channel}),
+        )
+        for channel in PIPELINE_CHANNELS
+    ]
+
+defs = Definitions(
+    jobs=[telegram_pipeline, telegram_partitioned_pipeline],
+    schedules=[daily_telegram_schedule],
+    resources={"pipeline_config": PipelineConfig()},
+)
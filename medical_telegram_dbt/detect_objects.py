@@ -1,8 +1,19 @@
 import os
+import time
+import json
+import queue
+import hashlib
+import sqlite3
+import multiprocessing
 import psycopg2
+from psycopg2.extras import execute_values
+import cv2
+from itertools import islice
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from ultralytics import YOLO
 import logging
-from datetime import datetime
+from datetime import timedelta
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -15,6 +26,39 @@ DB_PASSWORD = "Adey"
 
 IMAGE_BASE_DIR = "C:/Users/techin/telegram-medical-data-pipeline"
 YOLO_MODEL_NAME = "yolov8n.pt"
+CONFIDENCE_THRESHOLD = 0.01 # low threshold for debugging
+
+# Batched inference: decode threads prefetch images while the model runs on the previous batch
+DETECTION_MODE = os.getenv("DETECTION_MODE", "batch")  # 'batch' or 'single'
+BATCH_SIZE = int(os.getenv("DETECTION_BATCH_SIZE", "16"))
+DECODE_THREADS = int(os.getenv("DETECTION_DECODE_THREADS", "4"))
+IMAGE_SIZE = int(os.getenv("DETECTION_IMAGE_SIZE", "640"))  # model input size (longest side)
+FLUSH_SIZE = int(os.getenv("DETECTION_FLUSH_SIZE", "500"))  # detection rows buffered before a committed write
+
+# Work queue: pending images are fetched in keyset-paginated pages
+QUEUE_PAGE_SIZE = int(os.getenv("DETECTION_QUEUE_PAGE_SIZE", "1000"))
+# Raw images are enqueued by arrival (raw_telegram_images.loaded_at); the overlap re-scans rows
+# whose loading transaction started before, but committed after, the previous enqueue
+ENQUEUE_OVERLAP_MINUTES = int(os.getenv("DETECTION_ENQUEUE_OVERLAP_MINUTES", "60"))
+QUEUE_FULL_SYNC = os.getenv("DETECTION_QUEUE_FULL_SYNC", "false").lower() == "true"
+MAX_ATTEMPTS = int(os.getenv("DETECTION_MAX_ATTEMPTS", "3"))  # failures before an image is marked 'failed'
+
+# Detection cache: reuse detections for byte-identical images (reposts) across runs and hosts
+CACHE_ENABLED = os.getenv("DETECTION_CACHE", "true").lower() == "true"
+CACHE_LOOKUP_SIZE = int(os.getenv("DETECTION_CACHE_LOOKUP_SIZE", "256"))  # images hashed per cache lookup
+CACHE_MEMO_SIZE = 10000  # recently stored entries kept in memory to catch repeats within a run
+
+# Image store written by the scraper: its path index gives content hashes without re-reading
+# files, and its pre-resized variants (longest side = IMAGE_SIZE) replace full-resolution decode
+IMAGE_STORE_PATH = os.getenv("IMAGE_STORE_PATH", os.path.join(IMAGE_BASE_DIR, "data/raw/image_store"))
+IMAGE_STORE_INDEX_PATH = os.getenv(
+    "IMAGE_STORE_INDEX_PATH", os.path.join(IMAGE_BASE_DIR, "data/state/image_store_index.sqlite")
+)
+
+# Sharding: images are split by the queue's shard_key (hashtext(image_path)) % NUM_SHARDS;
+# this host runs SHARD_IDS (default: all)
+NUM_SHARDS = int(os.getenv("DETECTION_NUM_SHARDS", "1"))
+SHARD_IDS = [int(i) for i in os.getenv("DETECTION_SHARD_IDS", "").split(",") if i.strip()]
 
 # --- Database Connection ---
 def get_db_connection():
@@ -31,29 +75,180 @@ def get_db_connection():
         logging.error(f"Error connecting to the database: {e}")
         raise
 
-# --- Fetch Unprocessed Images ---
-def get_unprocessed_images(conn):
-    try:
-        cur = conn.cursor()
+# --- Detection Work Queue ---
+# Columns added to the queue after it was first created, with their definitions
+QUEUE_ADDED_COLUMNS = {
+    # loaded_at of the raw image row, the enqueue watermark
+    "source_loaded_at": "TIMESTAMPTZ",
+    # Stable per-image hash; shard workers select shard_key % num_shards in SQL
+    "shard_key": "INTEGER GENERATED ALWAYS AS (hashtext(image_path)) STORED",
+}
+QUEUE_INDEXES = {
+    # Keyset pagination over pending work only
+    "image_detection_queue_pending_idx": "(message_id, image_path) WHERE status = 'pending'",
+    "image_detection_queue_image_date_idx": "(image_date)",
+    "image_detection_queue_source_loaded_at_idx": "(source_loaded_at)",
+}
+
+def table_columns(cur, table_name):
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'public_staging' AND table_name = %s
+    """, (table_name,))
+    return {row[0] for row in cur.fetchall()}
+
+def ensure_work_queue(conn):
+    """
+    Creates the detection work queue, its columns and indexes if they don't exist yet. Indexes on
+    the tables the queue reads from are created by their owners (image loader, dbt).
+
+    Coordinators on several hosts may start at once against one database, so the bootstrap runs
+    under a transaction-level advisory lock, and DDL is only issued for what is actually missing:
+    once the schema is complete no statement locks the queue other hosts' workers are using.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('detect_objects.bootstrap'))")
+        columns = table_columns(cur, "image_detection_queue")
+        if not columns:
+            cur.execute("""
+                CREATE TABLE public_staging.image_detection_queue (
+                    image_path TEXT PRIMARY KEY,
+                    message_id BIGINT NOT NULL,
+                    image_date DATE,
+                    status TEXT NOT NULL DEFAULT 'pending',  -- pending | done | failed
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    enqueued_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    processed_at TIMESTAMPTZ
+                )
+            """)
+        for column_name, definition in QUEUE_ADDED_COLUMNS.items():
+            if column_name not in columns:
+                cur.execute(f"ALTER TABLE public_staging.image_detection_queue ADD COLUMN {column_name} {definition}")
         cur.execute("""
-            SELECT
-                sti.message_id,
-                sti.image_path
-            FROM public_staging.stg_telegram_images sti
-            LEFT JOIN public_staging.image_detections_staging ids
-                ON sti.image_path = ids.image_path
-            WHERE ids.image_path IS NULL
-            AND sti.image_path IS NOT NULL
-            GROUP BY sti.message_id, sti.image_path
-            ORDER BY sti.message_id
+            SELECT indexname FROM pg_indexes
+            WHERE schemaname = 'public_staging' AND tablename = 'image_detection_queue'
         """)
-        unprocessed_images = cur.fetchall()
-        cur.close()
-        logging.info(f"Found {len(unprocessed_images)} new images to process.")
-        return unprocessed_images
-    except Exception as e:
-        logging.error(f"Error fetching unprocessed images: {e}")
-        return []
+        indexes = {row[0] for row in cur.fetchall()}
+        for index_name, definition in QUEUE_INDEXES.items():
+            if index_name not in indexes:
+                cur.execute(f"CREATE INDEX {index_name} ON public_staging.image_detection_queue {definition}")
+        if CACHE_ENABLED:
+            ensure_detection_cache(cur)
+    conn.commit()  # releases the advisory lock
+
+def ensure_detection_cache(cur):
+    """
+    Creates the detection cache table. Runs from the coordinator's bootstrap (ensure_work_queue),
+    under its advisory lock and never from the shard workers, so concurrent processes don't race on the DDL.
+    """
+    columns = table_columns(cur, "detection_cache")
+    if columns and "image_size" not in columns:
+        # Entries from before image_size/detection_mode were part of the key can't be matched to
+        # a configuration; it's only a cache, so an old-format table is dropped and rebuilt
+        cur.execute("DROP TABLE public_staging.detection_cache")
+        columns = set()
+    if not columns:
+        cur.execute("""
+            CREATE TABLE public_staging.detection_cache (
+                content_hash TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                confidence_threshold REAL NOT NULL,
+                image_size INTEGER NOT NULL,
+                detection_mode TEXT NOT NULL,
+                detections JSONB NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (content_hash, model_name, confidence_threshold, image_size, detection_mode)
+            )
+        """)
+
+def enqueue_new_images(conn, full_sync=False, partition=None):
+    """
+    Adds newly loaded images to the work queue. Only raw images loaded since the newest queued
+    one (minus ENQUEUE_OVERLAP_MINUTES) are scanned, whatever their image_date, unless full_sync
+    is set or the queue is empty. With a (date, channel) partition, only that partition's images
+    are scanned. Images that already have detections (from before the queue existed) are enqueued as done.
+    """
+    partition_date, partition_channel = partition or (None, None)
+    with conn.cursor() as cur:
+        cur.execute("SELECT max(source_loaded_at) FROM public_staging.image_detection_queue")
+        newest_queued = cur.fetchone()[0]
+        since = None
+        if not (full_sync or partition or newest_queued is None):
+            since = newest_queued - timedelta(minutes=ENQUEUE_OVERLAP_MINUTES)
+        cur.execute("""
+            INSERT INTO public_staging.image_detection_queue
+                (image_path, message_id, image_date, source_loaded_at, status, processed_at)
+            SELECT
+                rti.image_path,
+                MIN(rti.message_id),
+                MIN(rti.image_date),
+                MAX(rti.loaded_at),
+                CASE WHEN EXISTS (
+                    SELECT 1 FROM public_staging.image_detections_staging ids WHERE ids.image_path = rti.image_path
+                ) THEN 'done' ELSE 'pending' END,
+                NULL
+            FROM public.raw_telegram_images rti
+            WHERE rti.image_path IS NOT NULL
+            AND (%(since)s::timestamptz IS NULL OR rti.loaded_at >= %(since)s::timestamptz)
+            AND (%(partition_date)s::date IS NULL OR rti.image_date = %(partition_date)s::date)
+            AND (%(partition_channel)s::text IS NULL OR rti.channel_username = %(partition_channel)s::text)
+            GROUP BY rti.image_path
+            ON CONFLICT (image_path) DO NOTHING
+        """, {"since": since, "partition_date": partition_date, "partition_channel": partition_channel})
+        enqueued = cur.rowcount
+    conn.commit()
+    if partition:
+        scope = f" (partition {partition_date}/{partition_channel})."
+    else:
+        scope = f" (loaded since {since})." if since else " (full sync)."
+    logging.info(f"Enqueued {enqueued} new images for detection" + scope)
+    return enqueued
+
+def iter_unprocessed_images(conn, page_size=QUEUE_PAGE_SIZE, partition=None, shard=None):
+    """
+    Yields pages of (message_id, image_path) pending in the work queue, using keyset pagination
+    so startup cost is constant and only one page is held in memory at a time.
+    With a (date, channel) partition, only that partition's pending images are returned;
+    with a (shard_id, num_shards) shard, only that shard's.
+    """
+    partition_date, partition_channel = partition or (None, None)
+    shard_id, num_shards = shard or (None, None)
+    last_key = (-1, "")
+    while True:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT message_id, image_path
+                    FROM public_staging.image_detection_queue
+                    WHERE status = 'pending'
+                    AND (message_id, image_path) > (%(last_message_id)s, %(last_image_path)s)
+                    AND (%(num_shards)s::int IS NULL OR mod(abs(shard_key::bigint), %(num_shards)s::int) = %(shard_id)s::int)
+                    AND (%(partition_date)s::date IS NULL OR (
+                        image_date = %(partition_date)s::date
+                        AND EXISTS (
+                            SELECT 1 FROM public.raw_telegram_images rti
+                            WHERE rti.image_path = image_detection_queue.image_path
+                            AND rti.channel_username = %(partition_channel)s::text
+                        )
+                    ))
+                    ORDER BY message_id, image_path
+                    LIMIT %(page_size)s
+                """, {
+                    "last_message_id": last_key[0], "last_image_path": last_key[1], "page_size": page_size,
+                    "partition_date": partition_date, "partition_channel": partition_channel,
+                    "shard_id": shard_id, "num_shards": num_shards,
+                })
+                page = cur.fetchall()
+            conn.commit()
+        except Exception as e:
+            logging.error(f"Error fetching unprocessed images: {e}")
+            conn.rollback()
+            return
+        if not page:
+            return
+        logging.info(f"Fetched a page of {len(page)} pending images.")
+        yield page
+        last_key = page[-1]
 
 # --- Load YOLO Model ---
 def load_yolo_model(model_name):
@@ -69,7 +264,7 @@ def load_yolo_model(model_name):
 def process_image_for_detection(model, image_full_path):
     detections = []
     try:
-        results = model(image_full_path, conf=0.01) # low threshold for debugging
+        results = model(image_full_path, conf=CONFIDENCE_THRESHOLD)
         total_boxes = 0
         for r in results:
             total_boxes += len(r.boxes)
@@ -85,18 +280,105 @@ def process_image_for_detection(model, image_full_path):
             logging.warning(f"No objects detected in {image_full_path}.")
     except Exception as e:
         logging.error(f"Error processing image {image_full_path}: {e}")
+        return None  # failed, not "no objects": keep it out of the results and the cache
     return detections
 
+# --- Batched Detection ---
+def decode_image(image_full_path, image_size=IMAGE_SIZE):
+    """Reads an image and downscales it so its longest side is image_size. Returns None if unreadable."""
+    image = cv2.imread(image_full_path)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    scale = image_size / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    return image
+
+def iter_decoded_batches(executor, images, batch_size=BATCH_SIZE):
+    """
+    Yields lists of (message_id, image_path, full_image_path, decoded_image), decoding up to two
+    batches ahead on the executor so the model never waits on JPEG decode. Images that could not
+    be decoded are yielded too, with decoded_image None, so they are recorded as failed.
+    """
+    pending = deque()
+    batch = []
+    images = iter(images)
+
+    def fill():
+        while len(pending) < batch_size * 2:
+            try:
+                message_id, image_path, full_image_path = next(images)
+            except StopIteration:
+                return
+            pending.append((message_id, image_path, full_image_path, executor.submit(decode_image, full_image_path)))
+
+    fill()
+    while pending:
+        message_id, image_path, full_image_path, future = pending.popleft()
+        fill()
+        try:
+            decoded = future.result()
+        except Exception as e:
+            logging.error(f"Error decoding image {full_image_path}: {e}")
+            decoded = None
+        if decoded is None:
+            logging.warning(f"Could not decode image {full_image_path}. Marking it failed.")
+        batch.append((message_id, image_path, full_image_path, decoded))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def process_batch_for_detection(model, batch):
+    """Runs the model on a batch of decoded images; returns one detections list per image (None if failed)."""
+    try:
+        results = model([decoded for _, _, _, decoded in batch], conf=CONFIDENCE_THRESHOLD, imgsz=IMAGE_SIZE, verbose=False)
+    except Exception as e:
+        logging.error(f"Error processing batch of {len(batch)} images: {e}")
+        return [None for _ in batch]
+
+    batch_detections = []
+    for (_, _, full_image_path, _), r in zip(batch, results):
+        detections = [
+            {
+                "detected_object_class": model.names[int(box.cls)],
+                "confidence_score": float(box.conf)
+            }
+            for box in r.boxes
+        ]
+        if not detections:
+            logging.warning(f"No objects detected in {full_image_path}.")
+        batch_detections.append(detections)
+    return batch_detections
+
+def to_detection_records(message_id, image_path, detections):
+    return [
+        {
+            "message_id": message_id,
+            "image_path": image_path,
+            "detected_object_class": det["detected_object_class"],
+            "confidence_score": det["confidence_score"]
+        }
+        for det in detections
+    ]
+
 # --- Insert to DB ---
-def insert_detections_into_db(conn, detections_to_insert):
-    if not detections_to_insert:
+def insert_detections_into_db(conn, detections_to_insert, processed_images=(), failed_images=()):
+    """
+    Inserts detection rows and updates the work queue for the images they came from in a single
+    transaction. processed_images are marked done (even with zero detections); failed_images get
+    another attempt, or are marked failed after MAX_ATTEMPTS.
+    """
+    if not detections_to_insert and not processed_images and not failed_images:
         logging.info("No new detections to insert.")
-        return
+        return 0
 
     sql = """
 INSERT INTO public_staging.image_detections_staging (
     message_id, image_path, detected_object_class, confidence_score
-) VALUES (%s, %s, %s, %s)
+) VALUES %s
 ON CONFLICT (message_id, image_path, detected_object_class) DO NOTHING;
 """
     cur = conn.cursor()
@@ -105,9 +387,30 @@ ON CONFLICT (message_id, image_path, detected_object_class) DO NOTHING;
             (det['message_id'], det['image_path'], det['detected_object_class'], det['confidence_score'])
             for det in detections_to_insert
         ]
-        cur.executemany(sql, data)
+        inserted = 0
+        if data:
+            # One statement (page_size=len(data)), so rowcount covers every row, minus conflicts
+            execute_values(cur, sql, data, page_size=len(data))
+            inserted = cur.rowcount
+        if processed_images:
+            cur.execute("""
+                UPDATE public_staging.image_detection_queue
+                SET status = 'done', attempts = attempts + 1, processed_at = now()
+                WHERE image_path = ANY(%s)
+            """, (list(processed_images),))
+        if failed_images:
+            cur.execute("""
+                UPDATE public_staging.image_detection_queue
+                SET attempts = attempts + 1,
+                    status = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE 'pending' END,
+                    processed_at = now()
+                WHERE image_path = ANY(%s)
+            """, (MAX_ATTEMPTS, list(failed_images)))
         conn.commit()
-        logging.info(f"Successfully inserted {len(data)} detection records.")
+        logging.info(
+            f"Successfully inserted {inserted} of {len(data)} detection records for {len(processed_images)} images."
+        )
+        return inserted
     except psycopg2.errors.UniqueViolation as e:
         logging.warning(f"Skipped inserting duplicates: {e}")
         conn.rollback()
@@ -116,41 +419,442 @@ ON CONFLICT (message_id, image_path, detected_object_class) DO NOTHING;
         conn.rollback()
     finally:
         cur.close()
+    return 0
 
-# --- Main Pipeline ---
-def main():
-    conn = None
+class DetectionBuffer:
+    """
+    Buffers detection rows and writes them in committed batches of ~FLUSH_SIZE rows.
+
+    Rows are only added per whole image and committed together with the image's work queue
+    status, so a run that dies resumes exactly where the last commit left off.
+    `written` counts rows actually inserted (duplicates skipped by ON CONFLICT don't count).
+    """
+
+    def __init__(self, conn, flush_size=FLUSH_SIZE):
+        self.conn = conn
+        self.flush_size = flush_size
+        self.rows = []
+        self.processed_images = []
+        self.failed_images = []
+        self.written = 0
+
+    def add_image(self, message_id, image_path, detections):
+        self.rows.extend(to_detection_records(message_id, image_path, detections))
+        self.processed_images.append(image_path)
+        self.flush_if_full()
+
+    def add_failed(self, image_path):
+        self.failed_images.append(image_path)
+        self.flush_if_full()
+
+    def flush_if_full(self):
+        if max(len(self.rows), len(self.processed_images) + len(self.failed_images)) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows and not self.processed_images and not self.failed_images:
+            return
+        self.written += insert_detections_into_db(self.conn, self.rows, self.processed_images, self.failed_images)
+        self.rows = []
+        self.processed_images = []
+        self.failed_images = []
+
+# --- Detection Cache ---
+def hash_file(image_full_path):
     try:
-        conn = get_db_connection()
-        model = load_yolo_model(YOLO_MODEL_NAME)
-        
-        unprocessed_images = get_unprocessed_images(conn)
-        all_detections_for_db = []
+        digest = hashlib.sha256()
+        with open(image_full_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    except OSError as e:
+        logging.error(f"Error hashing image {image_full_path}: {e}")
+        return None
+
+class DetectionCache:
+    """
+    Detections keyed by (image content hash, model name, confidence threshold, input size,
+    detection mode), stored in public_staging.detection_cache so all hosts and shards share it.
+    The table is created by ensure_detection_cache.
+    """
+
+    def __init__(self, conn, model_name=YOLO_MODEL_NAME, confidence_threshold=CONFIDENCE_THRESHOLD,
+                 image_size=IMAGE_SIZE, detection_mode=DETECTION_MODE):
+        self.conn = conn
+        self.model_name = model_name
+        self.confidence_threshold = confidence_threshold
+        self.image_size = image_size
+        self.detection_mode = detection_mode
+        self.memo = OrderedDict()
+        self.pending = []
+
+    def lookup(self, content_hashes):
+        """Returns {content_hash: detections} for the hashes that are cached."""
+        found = {h: self.memo[h] for h in content_hashes if h in self.memo}
+        missing = [h for h in content_hashes if h not in found]
+        if missing:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT content_hash, detections FROM public_staging.detection_cache
+                    WHERE content_hash = ANY(%s) AND model_name = %s AND confidence_threshold = %s::real
+                    AND image_size = %s AND detection_mode = %s
+                    """,
+                    (missing, self.model_name, self.confidence_threshold, self.image_size, self.detection_mode)
+                )
+                found.update(cur.fetchall())
+            self.conn.commit()
+        return found
+
+    def add(self, content_hash, detections):
+        self.memo[content_hash] = detections
+        self.memo.move_to_end(content_hash)
+        if len(self.memo) > CACHE_MEMO_SIZE:
+            self.memo.popitem(last=False)
+        self.pending.append((
+            content_hash, self.model_name, self.confidence_threshold, self.image_size, self.detection_mode,
+            json.dumps(detections)
+        ))
+        if len(self.pending) >= CACHE_LOOKUP_SIZE:
+            self.flush()
 
+    def flush(self):
+        if not self.pending:
+            return
+        try:
+            with self.conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO public_staging.detection_cache
+                        (content_hash, model_name, confidence_threshold, image_size, detection_mode, detections)
+                    VALUES %s
+                    ON CONFLICT DO NOTHING
+                    """,
+                    self.pending, template="(%s, %s, %s::real, %s, %s, %s::jsonb)", page_size=len(self.pending)
+                )
+            self.conn.commit()
+        except Exception as e:
+            logging.error(f"Error writing detection cache entries: {e}")
+            self.conn.rollback()
+        self.pending = []
+
+# --- Image Store ---
+class ImageStoreIndex:
+    """Read-only view of the scraper's content-addressed image store (see src/scraping/image_store.py)."""
+
+    def __init__(self, index_path=IMAGE_STORE_INDEX_PATH, store_path=IMAGE_STORE_PATH, image_size=IMAGE_SIZE):
+        self.store_path = store_path
+        self.image_size = image_size
+        self.variants_used = 0
+        self.conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True, timeout=60)
+
+    @classmethod
+    def open_if_present(cls):
+        if not os.path.exists(IMAGE_STORE_INDEX_PATH):
+            return None
+        logging.info(f"Using image store index {IMAGE_STORE_INDEX_PATH}")
+        return cls()
+
+    def content_hashes(self, image_paths):
+        """Returns {image_path: sha256} for the indexed paths among image_paths."""
+        keys = {image_path.replace("\\", "/"): image_path for image_path in image_paths}
+        if not keys:
+            return {}
+        placeholders = ", ".join("?" for _ in keys)
+        rows = self.conn.execute(
+            f"SELECT image_path, content_hash FROM image_files WHERE image_path IN ({placeholders})", list(keys)
+        ).fetchall()
+        return {keys[key]: content_hash for key, content_hash in rows}
+
+    def variant_path(self, content_hash):
+        """The detector-sized copy of an image, or None if it has none (e.g. already small)."""
+        path = os.path.join(self.store_path, content_hash[:2], f"{content_hash}_{self.image_size}.jpg")
+        return path if os.path.exists(path) else None
+
+    def close(self):
+        self.conn.close()
+
+def iter_variant_images(images, store_index):
+    """Swaps each image's full-resolution path for its pre-resized variant from the image store, if there is one."""
+    images = iter(images)
+    while True:
+        chunk = list(islice(images, CACHE_LOOKUP_SIZE))
+        if not chunk:
+            return
+        hashes = store_index.content_hashes([image_path for _, image_path, _ in chunk])
+        for message_id, image_path, full_image_path in chunk:
+            variant = store_index.variant_path(hashes[image_path]) if image_path in hashes else None
+            if variant:
+                store_index.variants_used += 1
+            yield message_id, image_path, variant or full_image_path
+
+def iter_uncached_images(executor, images, cache, detection_buffer, stats, content_hashes, in_flight,
+                         store_index=None):
+    """
+    Hashes images on the executor and serves cache hits straight into detection_buffer.
+    Yields only the misses; their hashes are recorded in content_hashes[image_path].
+    A miss whose content is already being inferred isn't yielded again but waits in
+    in_flight[content_hash] for that image's result.
+    Hashes already in the image store index are reused instead of re-reading the file.
+    """
+    images = iter(images)
+    while True:
+        chunk = list(islice(images, CACHE_LOOKUP_SIZE))
+        if not chunk:
+            return
+        known = store_index.content_hashes([image_path for _, image_path, _ in chunk]) if store_index else {}
+        hashes = list(executor.map(lambda image: known.get(image[1]) or hash_file(image[2]), chunk))
+        cached = cache.lookup(list({h for h in hashes if h}))
+        for (message_id, image_path, full_image_path), content_hash in zip(chunk, hashes):
+            if content_hash in cached:
+                detection_buffer.add_image(message_id, image_path, cached[content_hash])
+                stats["cache_hits"] += 1
+                continue
+            if content_hash:
+                if content_hash in in_flight:
+                    in_flight[content_hash].append((message_id, image_path))
+                    continue
+                in_flight[content_hash] = []
+                content_hashes[image_path] = content_hash
+            yield message_id, image_path, full_image_path
+
+# --- Detection Run ---
+def run_detection(conn, model, unprocessed_images, report_progress=None):
+    """
+    Runs detection over an iterable of (message_id, image_path) pairs, streaming results to the
+    database. report_progress(done) is called after every image/batch if given.
+    Returns a stats dict with processed/missing/failed/cache_hits/written counts and elapsed seconds.
+    """
+    detection_buffer = DetectionBuffer(conn)
+    cache = DetectionCache(conn) if CACHE_ENABLED else None
+    store_index = ImageStoreIndex.open_if_present()
+    stats = {"processed": 0, "missing": 0, "failed": 0, "cache_hits": 0}
+
+    def iter_existing_images():
         for message_id, image_path in unprocessed_images:
             full_image_path = os.path.join(IMAGE_BASE_DIR, image_path.lstrip('/'))
-
             if os.path.exists(full_image_path):
-                logging.info(f"Processing image: {full_image_path} for message_id: {message_id}")
-                detections = process_image_for_detection(model, full_image_path)
-                for det in detections:
-                    all_detections_for_db.append({
-                        "message_id": message_id,
-                        "image_path": image_path,
-                        "detected_object_class": det["detected_object_class"],
-                        "confidence_score": det["confidence_score"]
-                    })
+                yield message_id, image_path, full_image_path
             else:
                 logging.warning(f"Image file not found: {full_image_path}. Skipping.")
+                detection_buffer.add_failed(image_path)
+                stats["missing"] += 1
 
-        insert_detections_into_db(conn, all_detections_for_db)
+    content_hashes = {}
+    in_flight = {}  # content_hash -> [(message_id, image_path)] duplicates waiting for its inference
 
+    def record(message_id, image_path, detections):
+        content_hash = content_hashes.pop(image_path, None)
+        duplicates = in_flight.pop(content_hash, []) if content_hash else []
+        if detections is None:
+            for failed_path in [image_path] + [path for _, path in duplicates]:
+                detection_buffer.add_failed(failed_path)
+            stats["failed"] += 1 + len(duplicates)
+            return
+        detection_buffer.add_image(message_id, image_path, detections)
+        for duplicate_message_id, duplicate_path in duplicates:
+            detection_buffer.add_image(duplicate_message_id, duplicate_path, detections)
+        stats["cache_hits"] += len(duplicates)
+        if content_hash:
+            cache.add(content_hash, detections)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=DECODE_THREADS) as executor:
+        images = iter_existing_images()
+        if cache:
+            images = iter_uncached_images(
+                executor, images, cache, detection_buffer, stats, content_hashes, in_flight, store_index
+            )
+        if store_index:
+            # After the cache stage, which must hash the original bytes
+            images = iter_variant_images(images, store_index)
+
+        if DETECTION_MODE == "single":
+            for message_id, image_path, full_image_path in images:
+                logging.info(f"Processing image: {full_image_path} for message_id: {message_id}")
+                record(message_id, image_path, process_image_for_detection(model, full_image_path))
+                stats["processed"] += 1
+                if report_progress:
+                    report_progress(stats["processed"] + stats["cache_hits"])
+        else:
+            logging.info(f"Batched detection: batch size {BATCH_SIZE}, {DECODE_THREADS} decode threads.")
+            for batch in iter_decoded_batches(executor, images):
+                decodable = [item for item in batch if item[3] is not None]
+                batch_detections = iter(process_batch_for_detection(model, decodable) if decodable else [])
+                for message_id, image_path, _, decoded in batch:
+                    record(message_id, image_path, next(batch_detections) if decoded is not None else None)
+                stats["processed"] += len(batch)
+                elapsed = time.monotonic() - start
+                done = stats["processed"] + stats["cache_hits"]
+                logging.info(f"Processed {done} images ({done / elapsed:.2f} images/sec)")
+                if report_progress:
+                    report_progress(done)
+
+    # Duplicates still parked behind an image whose result never came back fail with it, not silently
+    for duplicates in in_flight.values():
+        for _, duplicate_path in duplicates:
+            detection_buffer.add_failed(duplicate_path)
+        stats["failed"] += len(duplicates)
+    in_flight.clear()
+
+    detection_buffer.flush()
+    if cache:
+        cache.flush()
+    elapsed = time.monotonic() - start
+    done = stats["processed"] + stats["cache_hits"]
+    logging.info(
+        f"Detection finished: {done} images in {elapsed:.1f}s "
+        f"({done / elapsed if elapsed else 0:.2f} images/sec, {DETECTION_MODE} mode)"
+    )
+    if cache:
+        hit_rate = stats["cache_hits"] / done if done else 0.0
+        logging.info(f"Detection cache: {stats['cache_hits']} hits, {stats['processed']} inferred ({hit_rate:.1%} hit rate)")
+    if store_index:
+        logging.info(f"Image store: decoded {store_index.variants_used} pre-resized variants instead of originals")
+        store_index.close()
+    logging.info(f"Wrote {detection_buffer.written} detection records in total.")
+    stats["written"] = detection_buffer.written
+    stats["elapsed"] = elapsed
+    return stats
+
+# --- Sharded Detection ---
+def shard_worker(shard_id, num_shards, threads_per_worker, progress_queue):
+    """Worker process: loads its own model and processes the images that hash to shard_id."""
+    conn = None
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker)
+
+        conn = get_db_connection()
+        model = load_yolo_model(YOLO_MODEL_NAME)
+        images = (image for page in iter_unprocessed_images(conn, shard=(shard_id, num_shards)) for image in page)
+        stats = run_detection(
+            conn, model, images,
+            report_progress=lambda done: progress_queue.put(("progress", shard_id, done))
+        )
+        progress_queue.put(("done", shard_id, stats))
     except Exception as e:
-        logging.critical(f"Script failed: {e}")
+        logging.critical(f"[shard {shard_id}/{num_shards}] failed: {e}")
+        progress_queue.put(("failed", shard_id, str(e)))
     finally:
         if conn:
             conn.close()
-            logging.info("Database connection closed.")
+
+def run_sharded(shard_ids, num_shards):
+    """
+    Coordinator: starts one worker process per local shard id and aggregates their progress.
+    Different hosts can run disjoint shard ids against the same database.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    progress_queue = ctx.Queue()
+    threads_per_worker = max(1, (os.cpu_count() or 1) // len(shard_ids))
+    workers = {
+        shard_id: ctx.Process(
+            target=shard_worker, args=(shard_id, num_shards, threads_per_worker, progress_queue),
+            name=f"detect-shard-{shard_id}"
+        )
+        for shard_id in shard_ids
+    }
+    logging.info(
+        f"Starting {len(workers)} detection workers for shards {list(shard_ids)} of {num_shards} "
+        f"({threads_per_worker} torch threads each)."
+    )
+    conn = get_db_connection()
+    try:
+        ensure_work_queue(conn)
+        enqueue_new_images(conn, full_sync=QUEUE_FULL_SYNC)
+    finally:
+        conn.close()
+
+    for worker in workers.values():
+        worker.start()
+
+    start = time.monotonic()
+    progress = {shard_id: 0 for shard_id in shard_ids}
+    results = {}
+    failures = {}
+    while len(results) + len(failures) < len(workers):
+        try:
+            message = progress_queue.get(timeout=30)
+        except queue.Empty:
+            # A worker that died without reporting (e.g. OOM-killed) counts as failed
+            for shard_id, worker in workers.items():
+                if shard_id not in results and shard_id not in failures and not worker.is_alive():
+                    failures[shard_id] = f"exited with code {worker.exitcode}"
+            continue
+        kind, shard_id, payload = message[0], message[1], message[2:]
+        if kind == "progress":
+            progress[shard_id] = payload[0]
+            done = sum(progress.values())
+            elapsed = time.monotonic() - start
+            logging.info(f"[coordinator] {done} images across shards ({done / elapsed:.2f} images/sec)")
+        elif kind == "done":
+            results[shard_id] = payload[0]
+        else:
+            failures[shard_id] = payload[0]
+
+    for worker in workers.values():
+        worker.join()
+
+    elapsed = time.monotonic() - start
+    processed = sum(stats["processed"] + stats["cache_hits"] for stats in results.values())
+    cache_hits = sum(stats["cache_hits"] for stats in results.values())
+    logging.info(
+        f"[coordinator] {processed} images ({cache_hits} from cache), "
+        f"{sum(stats['written'] for stats in results.values())} detections, "
+        f"{sum(stats['missing'] for stats in results.values())} missing files in {elapsed:.1f}s "
+        f"({processed / elapsed if elapsed else 0:.2f} images/sec)"
+    )
+    for shard_id, error in sorted(failures.items()):
+        logging.error(f"[coordinator] shard {shard_id} failed: {error}")
+    return results, failures
+
+# --- Main Pipeline ---
+def detect_new_images(partition=None):
+    """
+    Enqueues newly loaded images and runs detection on all pending ones in this process,
+    or only on one (date, channel) partition's images. Raises on failure.
+    """
+    conn = get_db_connection()
+    try:
+        model = load_yolo_model(YOLO_MODEL_NAME)
+
+        ensure_work_queue(conn)
+        enqueue_new_images(conn, full_sync=QUEUE_FULL_SYNC, partition=partition)
+        unprocessed_images = (image for page in iter_unprocessed_images(conn, partition=partition) for image in page)
+        return run_detection(conn, model, unprocessed_images)
+    finally:
+        conn.close()
+        logging.info("Database connection closed.")
+
+def run(partition=None):
+    """
+    Pipeline entry point: one (date, channel) partition in this process, or every pending image,
+    sharded across worker processes when NUM_SHARDS > 1. Raises on failure.
+    """
+    if partition:
+        # A single partition is small enough for one process; sharding is for full runs
+        return detect_new_images(partition=partition)
+    if NUM_SHARDS > 1:
+        results, failures = run_sharded(SHARD_IDS or list(range(NUM_SHARDS)), NUM_SHARDS)
+        if failures:
+            raise RuntimeError(f"Detection shards failed: {failures}")
+        return results
+    return detect_new_images()
+
+def main():
+    if NUM_SHARDS > 1:
+        shard_ids = SHARD_IDS or list(range(NUM_SHARDS))
+        _, failures = run_sharded(shard_ids, NUM_SHARDS)
+        if failures:
+            raise SystemExit(1)
+        return
+
+    try:
+        detect_new_images()
+    except Exception as e:
+        logging.critical(f"Script failed: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
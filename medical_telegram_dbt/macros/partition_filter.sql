@@ -0,0 +1,9 @@
+{% macro partition_filter(timestamp_column, channel_column) %}
+  {#- Rows of the run's partition_date / partition_channel vars. Partition dates are UTC days (like the
+      scraper's data/raw/<date>/ folders), so the bounds don't depend on the session time zone -#}
+    {{ timestamp_column }} >= ('{{ var("partition_date") }}'::date)::timestamp AT TIME ZONE 'UTC'
+    AND {{ timestamp_column }} < ('{{ var("partition_date") }}'::date + 1)::timestamp AT TIME ZONE 'UTC'
+    {% if var('partition_channel', none) %}
+    AND {{ channel_column }} = '{{ var("partition_channel") }}'
+    {% endif %}
+{% endmacro %}
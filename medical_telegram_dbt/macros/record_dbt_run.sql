@@ -0,0 +1,15 @@
+{% macro record_dbt_run() %}
+  {#- Appends a row to dbt_run_log after every run/build; the API uses it to invalidate its response cache -#}
+  {% if flags.WHICH in ('run', 'build') %}
+    CREATE TABLE IF NOT EXISTS {{ target.schema }}_marts.dbt_run_log (
+        invocation_id TEXT PRIMARY KEY,
+        run_started_at TIMESTAMPTZ NOT NULL,
+        finished_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    INSERT INTO {{ target.schema }}_marts.dbt_run_log (invocation_id, run_started_at)
+    VALUES ('{{ invocation_id }}', '{{ run_started_at }}')
+    ON CONFLICT (invocation_id) DO NOTHING;
+  {% else %}
+    SELECT 1;
+  {% endif %}
+{% endmacro %}
@@ -0,0 +1,49 @@
+-- medical_telegram_dwh/models/marts/agg_channel_daily_activity.sql
+-- Pre-aggregated daily posting activity per channel, served by /api/channels/{channel_name}/activity
+-- Incremental: every day with fct_messages rows rebuilt since the last run is re-aggregated in full.
+-- With --vars '{partition_date: YYYY-MM-DD, partition_channel: name}' only that channel-day is re-aggregated.
+{{ config(
+    materialized='incremental',
+    unique_key=['channel_key', 'activity_date'],
+    incremental_strategy='delete+insert',
+    schema='marts',
+    indexes=[
+        {'columns': ['channel_key', 'activity_date']}
+    ]
+) }}
+
+SELECT
+    dc.channel_username,
+    LOWER(dc.channel_username) AS channel_key, -- Case-insensitive exact-match lookup key
+    fm.date_fk AS activity_date,
+    COUNT(fm.message_id) AS total_messages,
+    SUM(fm.message_views) AS total_views,
+    SUM(CASE WHEN fm.has_image_attachment THEN 1 ELSE 0 END) AS messages_with_images,
+    AVG(fm.message_length) AS avg_message_length,
+    CURRENT_TIMESTAMP AS dbt_loaded_at
+FROM
+    {{ ref('fct_messages') }} fm
+JOIN
+    {{ ref('dim_channels') }} dc ON fm.channel_fk = dc.channel_sk
+WHERE
+    fm.date_fk IS NOT NULL
+{% if is_incremental() and var('partition_date', none) %}
+    AND fm.date_fk = '{{ var("partition_date") }}'::date
+    {% if var('partition_channel', none) %}
+    AND dc.channel_username = '{{ var("partition_channel") }}'
+    {% endif %}
+{% elif is_incremental() %}
+    -- The lookback covers fct_messages rows written by a run that overlapped the last aggregation
+    AND fm.date_fk IN (
+        SELECT DISTINCT date_fk
+        FROM {{ ref('fct_messages') }}
+        WHERE dbt_loaded_at >= (
+            SELECT COALESCE(MAX(dbt_loaded_at), '-infinity'::timestamptz)
+                - INTERVAL '{{ var("agg_channel_daily_activity_lookback_hours", 24) }} hours'
+            FROM {{ this }}
+        )
+    )
+{% endif %}
+GROUP BY
+    dc.channel_username,
+    fm.date_fk
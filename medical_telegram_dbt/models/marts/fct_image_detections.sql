@@ -1,4 +1,23 @@
-{{ config(materialized='table', schema='marts') }}
+-- Incremental: detections written since the last run (minus a lookback for detector transactions that
+-- committed late) are ranked and merged on (image_path, class). Detections whose message wasn't in
+-- fct_messages yet are dropped by the join and picked up again by the run that builds that message.
+-- Run `dbt run --full-refresh --select fct_image_detections` to rebuild from scratch.
+-- With --vars '{partition_date: YYYY-MM-DD, partition_channel: name}' only that partition's images are re-ranked.
+{{ config(
+    materialized='incremental',
+    unique_key=['image_path', 'detected_object_class'],
+    incremental_strategy='delete+insert',
+    schema='marts',
+    pre_hook=[
+        "CREATE INDEX IF NOT EXISTS image_detections_staging_image_path_idx ON {{ source('public_staging', 'image_detections_staging') }} (image_path)",
+        "CREATE INDEX IF NOT EXISTS image_detections_staging_detection_timestamp_idx ON {{ source('public_staging', 'image_detections_staging') }} (detection_timestamp)",
+        "CREATE INDEX IF NOT EXISTS image_detections_staging_message_id_idx ON {{ source('public_staging', 'image_detections_staging') }} (message_id)"
+    ],
+    indexes=[
+        {'columns': ['image_path', 'detected_object_class'], 'unique': True},
+        {'columns': ['detection_timestamp']}
+    ]
+) }}
 
 WITH latest_detections AS (
     SELECT
@@ -13,6 +32,34 @@ WITH latest_detections AS (
         ) as rn
     FROM
         {{ source('public_staging', 'image_detections_staging') }}
+    {% if is_incremental() and var('partition_date', none) %}
+    WHERE
+        image_path IN (
+            SELECT image_path
+            FROM {{ source('raw', 'raw_telegram_images') }}
+            WHERE image_date = '{{ var("partition_date") }}'::date
+            {% if var('partition_channel', none) %}
+            AND channel_username = '{{ var("partition_channel") }}'
+            {% endif %}
+        )
+    {% elif is_incremental() %}
+    WHERE
+        detection_timestamp >= (
+            SELECT COALESCE(MAX(detection_timestamp), '-infinity'::timestamptz)
+                - INTERVAL '{{ var("fct_image_detections_lookback_hours", 24) }} hours'
+            FROM {{ this }}
+        )
+        -- Messages fct_messages (re)built since the last run, so detections that arrived before their message join now
+        OR message_id IN (
+            SELECT message_id
+            FROM {{ ref('fct_messages') }}
+            WHERE dbt_loaded_at >= (
+                SELECT COALESCE(MAX(dbt_loaded_at), '-infinity'::timestamptz)
+                    - INTERVAL '{{ var("fct_image_detections_lookback_hours", 24) }} hours'
+                FROM {{ this }}
+            )
+        )
+    {% endif %}
 )
 
 SELECT
@@ -27,7 +74,7 @@ SELECT
     CURRENT_TIMESTAMP AS dbt_loaded_at
 FROM
     latest_detections ld
-INNER JOIN  -- change here from LEFT JOIN to INNER JOIN
+INNER JOIN  -- unmatched detections stay out until their message reaches fct_messages (see above)
     {{ ref('fct_messages') }} fm ON ld.message_id = fm.message_id
 WHERE
     ld.rn = 1
\ No newline at end of file
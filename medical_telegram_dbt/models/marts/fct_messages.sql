@@ -1,5 +1,24 @@
 -- medical_telegram_dwh/models/marts/fct_messages.sql
-{{ config(materialized='table', schema='marts') }}
+-- Incremental: messages new or changed in staging since the last run (by raw_loaded_at, which moves on
+-- re-scrapes and edits) and those inside the lookback window (late-loaded images) are rebuilt.
+-- Run `dbt run --full-refresh --select fct_messages` to rebuild from scratch.
+-- With --vars '{partition_date: YYYY-MM-DD, partition_channel: name}' only that partition's rows are rebuilt.
+{{ config(
+    materialized='incremental',
+    unique_key='message_id',
+    incremental_strategy='delete+insert',
+    on_schema_change='append_new_columns',
+    schema='marts',
+    pre_hook="CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    indexes=[
+        {'columns': ['message_id'], 'unique': True},
+        {'columns': ['full_message_timestamp']},
+        {'columns': ['raw_loaded_at']},
+        {'columns': ['dbt_loaded_at']},
+        {'columns': ['message_tsv'], 'type': 'gin'},
+        {'columns': ['message_text gin_trgm_ops'], 'type': 'gin'}
+    ]
+) }}
 
 WITH message_image_counts AS (
     SELECT
@@ -25,12 +44,33 @@ SELECT
     sm.has_image_attachment,
     sm.message_timestamp AS full_message_timestamp,
     COALESCE(mic.num_images_attached, 0) AS num_images_attached,
+    -- Full-text search vector for /api/search/messages ('simple' = no stemming, language-agnostic)
+    to_tsvector('simple', COALESCE(sm.message_text, '')) AS message_tsv,
+    sm.raw_loaded_at,
     CURRENT_TIMESTAMP AS dbt_loaded_at
 FROM
     {{ ref('stg_telegram_messages') }} sm
 LEFT JOIN
     {{ ref('dim_channels') }} dc ON sm.channel_username = dc.channel_username
 LEFT JOIN
-    {{ ref('dim_dates') }} dd ON sm.message_timestamp::date = dd.date_pk
+    {{ ref('dim_dates') }} dd ON (sm.message_timestamp AT TIME ZONE 'UTC')::date = dd.date_pk -- UTC day, like partitions
 LEFT JOIN
-    message_image_counts mic ON sm.message_id = mic.message_id
\ No newline at end of file
+    message_image_counts mic ON sm.message_id = mic.message_id
+{% if is_incremental() and var('partition_date', none) %}
+WHERE
+    {{ partition_filter('sm.message_timestamp', 'sm.channel_username') }}
+{% elif is_incremental() %}
+WHERE
+    -- Re-process recent messages so late-loaded images are picked up
+    sm.message_timestamp >= (
+        SELECT COALESCE(MAX(full_message_timestamp), '1900-01-01'::timestamptz)
+            - INTERVAL '{{ var("fct_messages_lookback_days", 3) }} days'
+        FROM {{ this }}
+    )
+    -- Any message new or changed in staging since the last run (backfills, edits, view refreshes)
+    OR sm.raw_loaded_at >= (
+        SELECT COALESCE(MAX(raw_loaded_at), '-infinity'::timestamptz)
+            - INTERVAL '{{ var("stg_loaded_at_overlap_minutes", 60) }} minutes'
+        FROM {{ this }}
+    )
+{% endif %}
\ No newline at end of file
@@ -1,24 +1,68 @@
 -- medical_telegram_dwh/models/staging/stg_telegram_messages.sql
-{{ config(materialized='view', schema='staging') }}
+-- Incremental table: raw_json is parsed once per newly loaded message instead of on every downstream read.
+-- The loaders upsert re-scraped and edited messages and bump raw loaded_at on every change, so new and
+-- changed rows are found by loaded_at; the overlap re-reads rows whose load committed after the last run.
+-- Run `dbt run --full-refresh --select stg_telegram_messages` to re-parse everything (e.g. after changing the extraction).
+-- With --vars '{partition_date: YYYY-MM-DD, partition_channel: name}' only that partition's rows are re-parsed.
+{{ config(
+    materialized='incremental',
+    unique_key='message_id',
+    incremental_strategy='delete+insert',
+    on_schema_change='append_new_columns',
+    schema='staging',
+    indexes=[
+        {'columns': ['message_id'], 'unique': True},
+        {'columns': ['channel_username']},
+        {'columns': ['message_timestamp']},
+        {'columns': ['raw_loaded_at']}
+    ]
+) }}
 
+WITH extracted AS (
+    SELECT
+        message_id,
+        message_timestamp,
+        channel_username,
+        -- Extract specific fields from the raw_json column once per row
+        (raw_json->>'sender_id')::BIGINT AS sender_id,
+        raw_json->>'message' AS message_text,
+        (raw_json->>'views')::INTEGER AS message_views,
+        raw_json->>'media_type' AS attached_media_type,
+        raw_json->>'media_path' AS attached_media_path,
+        loaded_at AS raw_loaded_at
+    FROM
+        {{ source('raw', 'raw_telegram_messages') }} r
+    {% if is_incremental() %}
+    WHERE
+    {% if var('partition_date', none) %}
+        {{ partition_filter('r.message_timestamp', 'r.channel_username') }}
+    {% else %}
+        r.loaded_at >= (
+            SELECT COALESCE(MAX(raw_loaded_at), '-infinity'::timestamptz)
+                - INTERVAL '{{ var("stg_loaded_at_overlap_minutes", 60) }} minutes'
+            FROM {{ this }}
+        )
+    {% endif %}
+    {% endif %}
+)
 SELECT
-    message_id,
+    message_id::BIGINT AS message_id,
     message_timestamp,
     channel_username,
-    -- Extract specific fields from the raw_json column (adjust based on your actual JSON structure)
-    raw_json->>'sender_id' AS sender_id, -- Assuming 'sender_id' is a key in your raw_json
-    raw_json->>'message' AS message_text,
+    sender_id,
+    message_text,
     -- FIX: Use COALESCE to default NULL views to 0
-    COALESCE((raw_json->>'views')::INTEGER, 0) AS message_views, 
-    raw_json->>'media_type' AS attached_media_type,
-    raw_json->>'media_path' AS attached_media_path,
-    
+    COALESCE(message_views, 0) AS message_views,
+    attached_media_type,
+    attached_media_path,
+
     -- Derived attributes
-    LENGTH(raw_json->>'message') AS message_length,
-    CASE WHEN raw_json->>'media_type' IS NOT NULL THEN TRUE ELSE FALSE END AS has_media_attachment,
-    CASE WHEN (raw_json->>'media_type') = 'photo' THEN TRUE ELSE FALSE END AS has_image_attachment
+    LENGTH(message_text) AS message_length,
+    (attached_media_type IS NOT NULL) AS has_media_attachment,
+    COALESCE(attached_media_type = 'photo', FALSE) AS has_image_attachment,
+    raw_loaded_at
 FROM
-    {{ source('raw', 'raw_telegram_messages') }}
+    extracted
 WHERE
-    (raw_json->>'message' IS NOT NULL AND TRIM(raw_json->>'message') != '')
-    OR (raw_json->>'media_type' IS NOT NULL) -- Include messages with just media, even if no text
\ No newline at end of file
+    (message_text IS NOT NULL AND TRIM(message_text) != '')
+    OR (attached_media_type IS NOT NULL) -- Include messages with just media, even if no text
@@ -0,0 +1,150 @@
+# my_api_project/cache.py
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Optional
+
+import asyncpg
+
+# Response cache settings
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # seconds; data normally changes nightly
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL")  # optional shared backend across workers
+RESPONSE_CACHE_MAX_AGE = int(os.getenv("RESPONSE_CACHE_MAX_AGE", "60"))  # Cache-Control max-age for clients
+DATA_VERSION_CHECK_INTERVAL = float(os.getenv("DATA_VERSION_CHECK_INTERVAL", "30"))  # seconds between dbt run checks
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """In-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: int = RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+
+
+class RedisCache:
+    """Shared cache backend so every API worker serves the same cached responses."""
+
+    def __init__(self, url: str, ttl: int = RESPONSE_CACHE_TTL, prefix: str = "telegram-api:"):
+        import redis.asyncio as redis  # optional dependency, only needed with RESPONSE_CACHE_REDIS_URL
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Redis cache get failed: {e}")
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any) -> None:
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Redis cache set failed: {e}")
+
+    async def clear(self) -> None:
+        # Keys embed the data version, so stale entries simply stop being read and expire by TTL
+        pass
+
+
+class DataVersion:
+    """
+    Tracks the latest completed dbt run (from public_marts.dbt_run_log, written by the
+    record_dbt_run on-run-end hook), re-checking at most every DATA_VERSION_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, check_interval: float = DATA_VERSION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.version = "unknown"
+        self._checked_at = float("-inf")
+
+    async def current(self, conn: asyncpg.Connection) -> str:
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self.version
+        try:
+            latest = await conn.fetchval("SELECT max(finished_at) FROM public_marts.dbt_run_log")
+            self.version = latest.isoformat() if latest else "unknown"
+        except asyncpg.PostgresError as e:
+            logger.warning(f"Could not read dbt run log, cache invalidation falls back to TTL: {e}")
+        self._checked_at = time.monotonic()
+        return self.version
+
+
+class ResponseCache:
+    """Caches endpoint responses per (endpoint, params, data version) and derives their ETags."""
+
+    def __init__(self):
+        self.backend = RedisCache(RESPONSE_CACHE_REDIS_URL) if RESPONSE_CACHE_REDIS_URL else LRUCache()
+        self.data_version = DataVersion()
+        self._last_version = None
+        self.hits = 0
+        self.misses = 0
+
+    async def version(self, conn: asyncpg.Connection) -> str:
+        version = await self.data_version.current(conn)
+        if self._last_version is not None and version != self._last_version:
+            logger.info(f"New dbt run detected ({version}), invalidating response cache.")
+            await self.backend.clear()
+        self._last_version = version
+        return version
+
+    @staticmethod
+    def key(endpoint: str, params: dict, version: str) -> str:
+        return f"{endpoint}?{json.dumps(params, sort_keys=True, default=str)}@{version}"
+
+    @staticmethod
+    def etag(key: str) -> str:
+        return 'W/"' + hashlib.sha1(key.encode("utf-8")).hexdigest() + '"'
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        await self.backend.set(key, value)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis" if isinstance(self.backend, RedisCache) else "memory",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "data_version": self._last_version,
+        }
+
+
+response_cache = ResponseCache()
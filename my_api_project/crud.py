@@ -1,12 +1,11 @@
 # my_api_project/crud.py
-from typing import List, Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor # Already imported via get_db_cursor
+import json
+import base64
+from datetime import date, datetime
+from typing import List, Dict, Any, Optional, Tuple
+import asyncpg
 
-# Assuming DB connection functions are in database.py
-from .database import get_db_cursor
-
-def get_top_products(conn: psycopg2.extensions.connection, limit: int = 10) -> List[Dict[str, Any]]:
+async def get_top_products(conn: asyncpg.Connection, limit: int = 10) -> List[Dict[str, Any]]:
     """
     Returns the most frequently detected objects/products from fct_image_detections.
     """
@@ -22,69 +21,156 @@ def get_top_products(conn: psycopg2.extensions.connection, limit: int = 10) -> L
         detected_object_class
     ORDER BY
         detection_count DESC
-    LIMIT %s;
+    LIMIT $1;
     """
-    with get_db_cursor(conn) as cur:
-        cur.execute(query, (limit,))
-        results = cur.fetchall()
-    return results
+    rows = await conn.fetch(query, limit)
+    return [dict(row) for row in rows]
 
-def get_channel_activity(conn: psycopg2.extensions.connection, channel_name: str) -> List[Dict[str, Any]]:
+async def get_channel_activity(conn: asyncpg.Connection, channel_name: str, start_date: Optional[date] = None,
+                               end_date: Optional[date] = None) -> List[Dict[str, Any]]:
     """
     Returns the posting activity for a specific channel, aggregated by date.
+    Reads the pre-aggregated agg_channel_daily_activity mart with an exact (case-insensitive)
+    match on the indexed channel_key, optionally limited to a date range (inclusive).
     """
     query = """
     SELECT
-        dc.channel_username,
-        dd.full_date AS date_fk, -- Changed 'date' to 'date_fk' to match the Pydantic schema
-        COUNT(fm.message_id) AS total_messages,
-        SUM(fm.message_views) AS total_views,
-        SUM(CASE WHEN fm.has_image_attachment THEN 1 ELSE 0 END) AS messages_with_images,
-        AVG(fm.message_length) AS avg_message_length
+        channel_username,
+        activity_date AS date_fk, -- Named 'date_fk' to match the Pydantic schema
+        total_messages,
+        total_views,
+        messages_with_images,
+        avg_message_length
     FROM
-        public_marts.fct_messages fm
-    JOIN
-        public_marts.dim_channels dc ON fm.channel_fk = dc.channel_sk
-    JOIN
-        public_marts.dim_dates dd ON fm.date_fk = dd.date_pk
+        public_marts.agg_channel_daily_activity
     WHERE
-        dc.channel_username ILIKE %s -- Case-insensitive search
-    GROUP BY
-        dc.channel_username,
-        dd.full_date
+        channel_key = LOWER($1)
+        AND ($2::date IS NULL OR activity_date >= $2::date)
+        AND ($3::date IS NULL OR activity_date <= $3::date)
     ORDER BY
-        dd.full_date ASC;
+        activity_date ASC;
     """
-    with get_db_cursor(conn) as cur:
-        cur.execute(query, (channel_name,))
-        results = cur.fetchall()
-    return results
+    rows = await conn.fetch(query, channel_name, start_date, end_date)
+    return [dict(row) for row in rows]
 
-def search_messages(conn: psycopg2.extensions.connection, query_text: str, limit: int = 100) -> List[Dict[str, Any]]:
-    """
-    Searches for messages containing a specific keyword in their text.
-    Uses PostgreSQL's ILIKE for case-insensitive substring matching.
-    For production, consider full-text search (e.g., tsvector/tsquery).
-    """
-    sql_query_text = f"%{query_text}%" # Add wildcards for substring search
-    query = """
+SEARCH_MODES = ("auto", "fts", "substring", "fuzzy")
+SEARCH_SORTS = ("relevance", "recent")
+
+def encode_cursor(values: list) -> str:
+    """Opaque keyset-pagination cursor for the last row of a page."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> list:
+    """Inverse of encode_cursor; raises ValueError on malformed input."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("Invalid cursor")
+    return values
+
+def parse_cursor_values(values: list, sort: str) -> Tuple[Any, int]:
+    """Validates a decoded [sort_key, message_id] cursor for `sort`; raises ValueError if it doesn't fit."""
+    last_key, last_id = values
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise ValueError("Invalid cursor")
+    if sort == "relevance":
+        if not isinstance(last_key, (int, float)) or isinstance(last_key, bool):
+            raise ValueError("Invalid cursor")
+        return float(last_key), last_id
+    if not isinstance(last_key, str):
+        raise ValueError("Invalid cursor")
+    try:
+        last_timestamp = datetime.fromisoformat(last_key)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if last_timestamp.tzinfo is None:
+        raise ValueError("Invalid cursor")
+    return last_timestamp, last_id
+
+async def _search(conn: asyncpg.Connection, query_text: str, limit: int, mode: str, sort: str,
+                  cursor_values: Optional[list]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    params: List[Any] = [query_text]
+    if mode == "fts":
+        # 'simple' config: no stemming, so drug names and transliterations match as typed
+        match = "fm.message_tsv @@ websearch_to_tsquery('simple', $1)"
+        rank = "ts_rank_cd(fm.message_tsv, websearch_to_tsquery('simple', $1))"
+    elif mode == "substring":
+        match = "fm.message_text ILIKE '%' || $1 || '%'"
+        rank = "word_similarity($1, fm.message_text)"
+    else:
+        # Trigram word similarity tolerates misspellings, e.g. "paracetamole" -> "paracetamol"
+        match = "$1 <% fm.message_text"
+        rank = "word_similarity($1, fm.message_text)"
+
+    if sort == "relevance":
+        sort_key, sort_key_cast = rank, "real"
+    else:
+        sort_key, sort_key_cast = "fm.full_message_timestamp", "timestamptz"
+
+    keyset = ""
+    if cursor_values is not None:
+        last_key, last_id = parse_cursor_values(cursor_values, sort)
+        params.extend([last_key, last_id])
+        keyset = f"AND ({sort_key}, fm.message_id) < (${len(params) - 1}::{sort_key_cast}, ${len(params)}::bigint)"
+    params.append(limit)
+
+    query = f"""
     SELECT
         fm.message_id,
         dc.channel_username,
         fm.message_text,
         fm.message_views,
-        fm.full_message_timestamp
+        fm.full_message_timestamp,
+        {sort_key} AS sort_key
     FROM
         public_marts.fct_messages fm
     JOIN
         public_marts.dim_channels dc ON fm.channel_fk = dc.channel_sk
     WHERE
-        fm.message_text ILIKE %s
+        {match}
+        {keyset}
     ORDER BY
-        fm.full_message_timestamp DESC
-    LIMIT %s;
+        sort_key DESC,
+        fm.message_id DESC
+    LIMIT ${len(params)};
     """
-    with get_db_cursor(conn) as cur:
-        cur.execute(query, (sql_query_text, limit))
-        results = cur.fetchall()
-    return results
\ No newline at end of file
+    rows = [dict(row) for row in await conn.fetch(query, *params)]
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        last_key = last["sort_key"].isoformat() if sort == "recent" else last["sort_key"]
+        next_cursor = encode_cursor([last_key, last["message_id"]])
+    for row in rows:
+        del row["sort_key"]
+    return rows, next_cursor
+
+async def search_messages(conn: asyncpg.Connection, query_text: str, limit: int = 100, mode: str = "auto",
+                          sort: str = "relevance", cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Searches message text and returns (messages, next_cursor).
+
+    Modes: 'fts' uses the GIN-indexed tsvector on fct_messages, 'substring' is ILIKE backed by
+    the trigram index, 'fuzzy' uses trigram word similarity for misspelled/transliterated terms,
+    and 'auto' runs 'fts' and falls back to 'fuzzy' when the first page comes back empty.
+    Results are ordered by relevance or recency and paginated by keyset: pass next_cursor back
+    as `cursor` to get the following page (the cursor is tied to the mode and sort used).
+    """
+    cursor_values = decode_cursor(cursor) if cursor else None
+    if mode != "auto":
+        return await _search(conn, query_text, limit, mode, sort, cursor_values)
+
+    if cursor_values is None:
+        rows, next_cursor = await _search(conn, query_text, limit, "fts", sort, None)
+        if rows:
+            return rows, next_cursor and encode_cursor(["fts"] + [decode_cursor(next_cursor)])
+        rows, next_cursor = await _search(conn, query_text, limit, "fuzzy", sort, None)
+        return rows, next_cursor and encode_cursor(["fuzzy"] + [decode_cursor(next_cursor)])
+
+    # Auto-mode cursors remember which mode produced the first page
+    resolved_mode, inner_values = cursor_values
+    if resolved_mode not in ("fts", "fuzzy") or not isinstance(inner_values, list) or len(inner_values) != 2:
+        raise ValueError("Invalid cursor")
+    rows, next_cursor = await _search(conn, query_text, limit, resolved_mode, sort, inner_values)
+    return rows, next_cursor and encode_cursor([resolved_mode] + [decode_cursor(next_cursor)])
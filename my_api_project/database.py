@@ -1,7 +1,8 @@
 # my_api_project/database.py
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor # To get results as dictionaries
+import asyncio
+from contextlib import asynccontextmanager
+import asyncpg
 from dotenv import load_dotenv
 
 # Load environment variables from .env file (ensure .env is in your project root or accessible)
@@ -15,46 +16,141 @@ DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "Adey") # <<< IMPORTANT: Replace or
 DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
 DB_PORT = os.getenv("POSTGRES_PORT", "5432")
 
+# Connection pool settings
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # connections opened at startup and kept open
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))  # extra connections allowed under load
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"  # check connections on checkout
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
 
-def get_db_connection():
-    """Establishes and returns a new PostgreSQL database connection."""
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within DB_POOL_TIMEOUT."""
+
+
+class AsyncDatabasePool:
+    """
+    asyncpg connection pool used by the API, so DB waits don't block the event loop.
+
+    Keeps `size` connections open and grows by up to `max_overflow` under load; callers
+    beyond that wait up to `timeout` seconds. Connections are health-checked on checkout
+    (if pre_ping) and broken ones are replaced.
+    """
+
+    def __init__(self, size=DB_POOL_SIZE, max_overflow=DB_POOL_MAX_OVERFLOW, timeout=DB_POOL_TIMEOUT,
+                 pre_ping=DB_POOL_PRE_PING, statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS):
+        self.size = size
+        self.max_size = size + max_overflow
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.statement_timeout_ms = statement_timeout_ms
+        self._pool = None
+        self._in_use = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._replaced = 0
+
+    async def open(self):
+        self._pool = await asyncpg.create_pool(
+            database=DB_NAME,
             user=DB_USER,
             password=DB_PASSWORD,
             host=DB_HOST,
-            port=DB_PORT
+            port=int(DB_PORT),
+            min_size=self.size,
+            max_size=self.max_size,
+            max_inactive_connection_lifetime=300,
+            server_settings={"statement_timeout": str(self.statement_timeout_ms)}
         )
-        return conn
-    except Exception as e:
-        print(f"Error connecting to the database: {e}")
-        # In a real application, you'd want more robust error handling/logging here
-        raise
-
-def get_db_cursor(conn):
-    """Returns a cursor for the given connection, configured to return dictionaries."""
-    return conn.cursor(cursor_factory=RealDictCursor)
-
-# Dependency for FastAPI to get a DB connection per request
-def get_db():
-    """FastAPI dependency that provides a database connection and ensures it's closed."""
-    conn = None
-    try:
-        conn = get_db_connection()
+
+    async def _acquire_healthy(self):
+        conn = await self._pool.acquire(timeout=self.timeout)
+        if not self.pre_ping:
+            return conn
+        try:
+            await conn.execute("SELECT 1")
+            return conn
+        except (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, OSError):
+            # Drop the broken connection; the pool reconnects on the next acquire
+            conn.terminate()
+            await self._pool.release(conn)
+            self._replaced += 1
+            return await self._pool.acquire(timeout=self.timeout)
+
+    @asynccontextmanager
+    async def acquire(self):
+        try:
+            conn = await self._acquire_healthy()
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise PoolTimeoutError(f"No database connection available within {self.timeout}s")
+        self._in_use += 1
+        self._checkouts += 1
+        try:
+            yield conn
+        finally:
+            self._in_use -= 1
+            await self._pool.release(conn)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "max_size": self.max_size,
+            "in_use": self._in_use,
+            "idle": self._pool.get_idle_size() if self._pool else 0,
+            "checkouts": self._checkouts,
+            "timeouts": self._timeouts,
+            "replaced_connections": self._replaced,
+        }
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+
+
+db_pool = None
+
+
+async def init_db_pool():
+    """Creates the global connection pool; called from the FastAPI startup hook."""
+    global db_pool
+    if db_pool is None:
+        db_pool = AsyncDatabasePool()
+        await db_pool.open()
+    return db_pool
+
+
+async def close_db_pool():
+    """Closes every pooled connection; called from the FastAPI shutdown hook."""
+    global db_pool
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
+
+
+def get_pool_stats():
+    return db_pool.stats() if db_pool is not None else None
+
+
+# Dependency for FastAPI to get a pooled DB connection per request
+async def get_db():
+    """FastAPI dependency that borrows a connection from the pool and returns it afterwards."""
+    pool = await init_db_pool()
+    async with pool.acquire() as conn:
         yield conn
-    finally:
-        if conn:
-            conn.close()
 
 if __name__ == "__main__":
     # Simple test to verify database connection
+    async def check_connection():
+        conn = await asyncpg.connect(
+            database=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=int(DB_PORT)
+        )
+        try:
+            print("Successfully connected to database:", await conn.fetchval("SELECT current_database();"))
+        finally:
+            await conn.close()
+
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT current_database();")
-        print("Successfully connected to database:", cur.fetchone()[0])
-        cur.close()
-        conn.close()
+        asyncio.run(check_connection())
     except Exception as e:
         print(f"Connection test failed: {e}")
\ No newline at end of file
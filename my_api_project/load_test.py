@@ -0,0 +1,69 @@
+# my_api_project/load_test.py
+"""
+Simple concurrent load test for the analytical API.
+
+Run it against a running server (e.g. `uvicorn my_api_project.main:app --workers 1`) once per
+build you want to compare, with the same settings, and compare the requests/sec it reports:
+
+    python -m my_api_project.load_test --base-url http://localhost:8000 --concurrency 50 --duration 30
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+DEFAULT_PATHS = [
+    "/api/reports/top-products?limit=10",
+    "/api/channels/lobelia4cosmetics/activity",
+    "/api/search/messages?query=paracetamol&limit=50",
+]
+
+
+async def worker(client, paths, deadline, latencies, errors):
+    i = 0
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.monotonic()
+        try:
+            response = await client.get(path)
+            # 404 is a valid "no results" answer for the activity/search endpoints
+            if response.status_code >= 500:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.monotonic() - start)
+
+
+async def run_load_test(base_url, paths, concurrency, duration):
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        deadline = time.monotonic() + duration
+        start = time.monotonic()
+        await asyncio.gather(*(worker(client, paths, deadline, latencies, errors) for _ in range(concurrency)))
+        elapsed = time.monotonic() - start
+
+    if not latencies:
+        print("No requests completed.")
+        return
+    latencies.sort()
+    print(f"Requests:     {len(latencies)} in {elapsed:.1f}s with concurrency {concurrency}")
+    print(f"Throughput:   {len(latencies) / elapsed:.1f} requests/sec")
+    print(f"Latency p50:  {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"Latency p95:  {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+    print(f"Errors:       {len(errors)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent load test for the analytical API.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run.")
+    parser.add_argument("--path", action="append", dest="paths",
+                        help="Endpoint path to hit (repeatable). Defaults to the three analytical endpoints.")
+    args = parser.parse_args()
+    asyncio.run(run_load_test(args.base_url, args.paths or DEFAULT_PATHS, args.concurrency, args.duration))
@@ -1,12 +1,16 @@
 # my_api_project/main.py
-from fastapi import FastAPI, Depends, HTTPException, Query
-from typing import List, Optional
-import psycopg2
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from typing import Any, Awaitable, Callable, List, Optional
+from datetime import date
+import asyncpg
 
 # Import your database connection and CRUD functions
-from .database import get_db
+from .database import get_db, init_db_pool, close_db_pool, get_pool_stats, PoolTimeoutError
 from . import crud
 from . import schemas
+from .cache import response_cache, RESPONSE_CACHE_MAX_AGE
 
 app = FastAPI(
     title="Telegram Medical Data Analytical API",
@@ -14,15 +18,54 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# --- Connection Pool Lifecycle ---
+@app.on_event("startup")
+async def startup_db_pool():
+    await init_db_pool()
+
+@app.on_event("shutdown")
+async def shutdown_db_pool():
+    await close_db_pool()
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+# --- Response Caching ---
+async def cached_response(
+    request: Request,
+    response: Response,
+    db: asyncpg.Connection,
+    params: dict,
+    compute: Callable[[], Awaitable[Any]]
+):
+    """
+    Serves an analytical endpoint from the response cache. Entries are keyed on endpoint + params +
+    the latest dbt run, so they are invalidated when a new run completes. Clients that send a
+    matching If-None-Match get a 304 without the query being run.
+    """
+    version = await response_cache.version(db)
+    key = response_cache.key(request.url.path, params, version)
+    etag = response_cache.etag(key)
+    cache_headers = {"ETag": etag, "Cache-Control": f"public, max-age={RESPONSE_CACHE_MAX_AGE}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+
+    data = await response_cache.get(key)
+    if data is None:
+        data = jsonable_encoder(await compute())
+        await response_cache.set(key, data)
+    response.headers.update(cache_headers)
+    return data
+
 # --- Health Check Endpoint ---
 @app.get("/health", response_model=schemas.HealthCheckResponse, summary="Health check endpoint")
-async def health_check(db: psycopg2.extensions.connection = Depends(get_db)):
+async def health_check(db: asyncpg.Connection = Depends(get_db)):
     """
     Checks the health of the API and its database connection.
     """
     try:
-        with db.cursor() as cur:
-            cur.execute("SELECT 1")
+        await db.fetchval("SELECT 1")
         db_status = "Connected"
     except Exception as e:
         db_status = f"Failed: {e}"
@@ -32,7 +75,9 @@ async def health_check(db: psycopg2.extensions.connection = Depends(get_db)):
     return schemas.HealthCheckResponse(
         status="OK",
         database_connection=db_status,
-        message="API is running and database connection is active."
+        message="API is running and database connection is active.",
+        pool=get_pool_stats(),
+        cache=response_cache.stats()
     )
 
 # --- Analytical Endpoints ---
@@ -43,14 +88,21 @@ async def health_check(db: psycopg2.extensions.connection = Depends(get_db)):
     summary="Get the most frequently detected products"
 )
 async def get_top_products_report(
+    request: Request,
+    response: Response,
     limit: int = Query(10, ge=1, le=100, description="Number of top products to return"),
-    db: psycopg2.extensions.connection = Depends(get_db)
+    db: asyncpg.Connection = Depends(get_db)
 ):
     """
     Returns a list of the most frequently detected objects/products from image analysis.
-    This queries the `public_marts.fct_image_detections` table.
+    This queries the `public_marts.fct_image_detections` table. Responses are cached until the next dbt run.
     """
-    products = crud.get_top_products(db, limit=limit)
+    products = await cached_response(
+        request, response, db, {"limit": limit},
+        lambda: crud.get_top_products(db, limit=limit)
+    )
+    if isinstance(products, Response):
+        return products
     if not products:
         # Return an empty list if no products are found, as it's a "report"
         return []
@@ -62,14 +114,26 @@ async def get_top_products_report(
     summary="Get posting activity for a specific channel"
 )
 async def get_channel_activity_report(
+    request: Request,
+    response: Response,
     channel_name: str,
-    db: psycopg2.extensions.connection = Depends(get_db)
+    start_date: Optional[date] = Query(None, description="Only include activity on or after this date"),
+    end_date: Optional[date] = Query(None, description="Only include activity on or before this date"),
+    db: asyncpg.Connection = Depends(get_db)
 ):
     """
     Returns the daily posting activity (messages, views, images, avg length)
-    for a specified Telegram channel.
+    for a specified Telegram channel, optionally within a date range.
+    Responses are cached until the next dbt run.
     """
-    activity = crud.get_channel_activity(db, channel_name=channel_name)
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=422, detail="start_date must be on or before end_date")
+    activity = await cached_response(
+        request, response, db, {"channel_name": channel_name.lower(), "start_date": start_date, "end_date": end_date},
+        lambda: crud.get_channel_activity(db, channel_name=channel_name, start_date=start_date, end_date=end_date)
+    )
+    if isinstance(activity, Response):
+        return activity
     if not activity:
         raise HTTPException(status_code=404, detail=f"No activity found for channel: {channel_name}")
     return activity
@@ -80,15 +144,31 @@ async def get_channel_activity_report(
     summary="Search for messages containing a specific keyword"
 )
 async def search_telegram_messages(
+    response: Response,
     query: str = Query(..., min_length=2, description="Keyword to search for in message text"),
     limit: int = Query(100, ge=1, le=500, description="Maximum number of messages to return"),
-    db: psycopg2.extensions.connection = Depends(get_db)
+    mode: str = Query("auto", description="Search mode: auto, fts, substring or fuzzy"),
+    sort: str = Query("relevance", description="Ordering: relevance or recent"),
+    cursor: Optional[str] = Query(None, description="Pagination cursor from the previous page's X-Next-Cursor header"),
+    db: asyncpg.Connection = Depends(get_db)
 ):
     """
-    Searches the `public_marts.fct_messages` table for messages containing the specified keyword
-    in their text content.
+    Searches the `public_marts.fct_messages` table for messages matching the specified keyword.
+    Full-text search is the default, falling back to trigram fuzzy matching for misspelled terms.
+    When more results are available, the `X-Next-Cursor` response header holds the cursor for the next page.
     """
-    messages = crud.search_messages(db, query_text=query, limit=limit)
+    if mode not in crud.SEARCH_MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of {', '.join(crud.SEARCH_MODES)}")
+    if sort not in crud.SEARCH_SORTS:
+        raise HTTPException(status_code=422, detail=f"sort must be one of {', '.join(crud.SEARCH_SORTS)}")
+    try:
+        messages, next_cursor = await crud.search_messages(
+            db, query_text=query, limit=limit, mode=mode, sort=sort, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not messages:
         raise HTTPException(status_code=404, detail=f"No messages found matching query: '{query}'")
-    return messages
\ No newline at end of file
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return messages
@@ -74,7 +74,25 @@ class MessageSearchResult(BaseModel):
     message_views: int
     full_message_timestamp: datetime
 
+class PoolStats(BaseModel):
+    size: int = Field(..., description="Connections kept open by the pool.")
+    max_size: int = Field(..., description="Pool size plus allowed overflow.")
+    in_use: int = Field(..., description="Connections currently checked out.")
+    idle: int = Field(..., description="Open connections waiting in the pool.")
+    checkouts: int = Field(..., description="Total connections handed out since startup.")
+    timeouts: int = Field(..., description="Requests that gave up waiting for a connection.")
+    replaced_connections: int = Field(..., description="Broken connections replaced on checkout.")
+
+class CacheStats(BaseModel):
+    backend: str = Field(..., description="Response cache backend: 'memory' or 'redis'.")
+    hits: int = Field(..., description="Responses served from the cache since startup (this worker).")
+    misses: int = Field(..., description="Responses computed because they weren't cached.")
+    hit_rate: float = Field(..., description="hits / (hits + misses).")
+    data_version: Optional[str] = Field(None, description="Latest dbt run the cached responses belong to.")
+
 class HealthCheckResponse(BaseModel):
     status: str
     database_connection: str
-    message: str
\ No newline at end of file
+    message: str
+    pool: Optional[PoolStats] = None
+    cache: Optional[CacheStats] = None
\ No newline at end of file
@@ -0,0 +1,50 @@
+import os
+import sqlite3
+from datetime import datetime
+
+MANIFEST_PATH = os.getenv("LOAD_MANIFEST_PATH", "data/state/load_manifest.sqlite")
+
+
+class LoadManifest:
+    """
+    Local SQLite index of raw files already loaded into Postgres, keyed by target table + path.
+
+    A file counts as loaded only if its mtime and size still match what was recorded, so
+    rewritten files are picked up again on the next run.
+    """
+
+    def __init__(self, target, path=MANIFEST_PATH):
+        self.target = target
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Partitioned pipeline runs load in parallel processes, so wait for the write lock
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS loaded_files (
+                target TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                loaded_at TEXT NOT NULL,
+                PRIMARY KEY (target, path)
+            )
+        """)
+        self.conn.commit()
+
+    def is_loaded(self, path, mtime, size):
+        row = self.conn.execute(
+            "SELECT mtime, size FROM loaded_files WHERE target = ? AND path = ?",
+            (self.target, path)
+        ).fetchone()
+        return row is not None and row[0] == mtime and row[1] == size
+
+    def mark_loaded(self, files):
+        """Records an iterable of (path, mtime, size) as loaded."""
+        loaded_at = datetime.now().isoformat()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO loaded_files (target, path, mtime, size, loaded_at) VALUES (?, ?, ?, ?, ?)",
+            ((self.target, path, mtime, size, loaded_at) for path, mtime, size in files)
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
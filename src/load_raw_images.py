@@ -1,8 +1,14 @@
 import os
+import argparse
 import psycopg2
+from psycopg2.extras import execute_values
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+from parallel_scan import scan_partitions, scan_files, bounded_parallel_map
+from load_manifest import LoadManifest
+
 load_dotenv()
 
 DB_NAME = os.getenv("POSTGRES_DB", "postgres")
@@ -11,76 +17,184 @@ DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
 DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
 DB_PORT = os.getenv("POSTGRES_PORT", "5432")
 
-conn = psycopg2.connect(
-    dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-)
-cur = conn.cursor()
+root_dir = os.getenv("RAW_IMAGES_DIR", "C:/Users/techin/telegram-medical-data-pipeline/data/raw/telegram_images")
 
-print(f"Connected to DB {DB_NAME} on {DB_HOST}:{DB_PORT} as {DB_USER}")
+# Directory listing is I/O bound, so a thread pool scans partitions while the main thread writes
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", str(os.cpu_count() or 1)))
+MAX_PENDING_PARTITIONS = LOAD_WORKERS * 4
 
-root_dir = "C:/Users/techin/telegram-medical-data-pipeline/data/raw/telegram_images"
+IMAGE_FILE_SUFFIXES = (".jpg", ".png")
 
-inserted_count = 0
-skipped_count = 0
+BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", "5000"))
 
-for date_dir in os.listdir(root_dir):
-    date_path = os.path.join(root_dir, date_dir)
-    if not os.path.isdir(date_path):
-        continue
 
+def scan_image_partition(date_dir, channel, channel_path):
+    """
+    Worker task: returns ([(message_id, channel, file_path, image_date, file_stat), ...], skipped)
+    for one partition, where file_stat is the (path, mtime, size) key used by the load manifest.
+    """
     try:
         image_date = datetime.strptime(date_dir, "%Y-%m-%d").date()
     except ValueError:
         print(f"⚠️ Skipping folder {date_dir}, not a valid date.")
-        continue
+        return [], 0
+
+    rows = []
+    skipped = 0
+    for file_stat in scan_files(channel_path, IMAGE_FILE_SUFFIXES):
+        file = os.path.basename(file_stat[0])
+        file_path = os.path.join("data/raw/telegram_images", date_dir, channel, file)  # relative path
 
-    for channel in os.listdir(date_path):
-        channel_path = os.path.join(date_path, channel)
-        if not os.path.isdir(channel_path):
+        # Expect filename like: message_<message_id>_<unique>.jpg
+        try:
+            parts = file.split("_")
+            message_id = int(parts[1])
+        except (IndexError, ValueError):
+            print(f"⚠️ Could not extract message_id from filename {file}")
+            skipped += 1
             continue
+        rows.append((message_id, channel, file_path, image_date, file_stat))
+    return rows, skipped
 
-        for file in os.listdir(channel_path):
-            if not (file.endswith(".jpg") or file.endswith(".png")):
-                continue
 
-            file_path = os.path.join("data/raw/telegram_images", date_dir, channel, file)  # relative path
+def iter_image_rows(base_dir, counts, partition=None):
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        for rows, skipped in bounded_parallel_map(
+            executor, scan_image_partition, scan_partitions(base_dir, partition), MAX_PENDING_PARTITIONS
+        ):
+            counts["skipped"] += skipped
+            yield from rows
 
-            # Expect filename like: message_<message_id>_<unique>.jpg
-            try:
-                parts = file.split("_")
-                message_id = int(parts[1])
-            except (IndexError, ValueError):
-                print(f"⚠️ Could not extract message_id from filename {file}")
-                skipped_count += 1
-                continue
 
-            # Verify message_id exists in parent table
-            cur.execute("SELECT 1 FROM raw_telegram_messages WHERE message_id=%s;", (message_id,))
-            if not cur.fetchone():
-                print(f"⚠️ message_id {message_id} does not exist in raw_telegram_messages. Skipping image.")
-                skipped_count += 1
+def ensure_raw_table(conn):
+    """
+    Adds the loaded_at arrival timestamp the detector enqueues from, and the indexes that
+    downstream readers (detector queue, partitioned dbt runs) filter raw images on.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            ALTER TABLE raw_telegram_images
+                ADD COLUMN IF NOT EXISTS loaded_at TIMESTAMPTZ NOT NULL DEFAULT now();
+            CREATE INDEX IF NOT EXISTS raw_telegram_images_loaded_at_idx
+                ON raw_telegram_images (loaded_at);
+            CREATE INDEX IF NOT EXISTS raw_telegram_images_image_date_idx
+                ON raw_telegram_images (image_date);
+        """)
+    conn.commit()
+
+
+REGISTER_IMAGES_SQL = """
+WITH v (message_id, channel_username, image_path, image_date) AS (
+    VALUES %s
+),
+valid AS (
+    SELECT v.*
+    FROM v
+    WHERE EXISTS (SELECT 1 FROM raw_telegram_messages m WHERE m.message_id = v.message_id)
+),
+ins AS (
+    INSERT INTO raw_telegram_images (message_id, channel_username, image_path, image_date)
+    SELECT message_id, channel_username, image_path, image_date FROM valid
+    ON CONFLICT DO NOTHING
+    RETURNING image_path
+)
+SELECT
+    v.image_path,
+    v.image_path IN (SELECT image_path FROM valid) AS has_parent,
+    v.image_path IN (SELECT image_path FROM ins) AS inserted
+FROM v;
+"""
+
+
+def register_batch(conn, batch):
+    """
+    Validates parent message ids and inserts a whole batch in one set-based statement.
+    Returns {image_path: (has_parent, inserted)}.
+    """
+    with conn.cursor() as cur:
+        results = execute_values(
+            cur, REGISTER_IMAGES_SQL,
+            [(message_id, channel, file_path, image_date) for message_id, channel, file_path, image_date, _ in batch],
+            page_size=len(batch), fetch=True
+        )
+    conn.commit()
+    return {image_path: (has_parent, inserted) for image_path, has_parent, inserted in results}
+
+
+def load_images(conn, base_dir, manifest, full_reload=False, batch_size=BATCH_SIZE, partition=None):
+    counts = {"inserted": 0, "skipped": 0, "already_loaded": 0, "existing": 0}
+    orphan_message_ids = set()
+    batch = []
+
+    def flush():
+        try:
+            statuses = register_batch(conn, batch)
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Failed to register batch of {len(batch)} images: {e}")
+            counts["skipped"] += len(batch)
+            batch.clear()
+            return
+        loaded_files = []
+        for message_id, _, file_path, _, file_stat in batch:
+            has_parent, inserted = statuses.get(file_path, (False, False))
+            if not has_parent:
+                # Orphans stay out of the manifest so they're retried once the parent message is loaded
+                orphan_message_ids.add(message_id)
+                counts["skipped"] += 1
                 continue
+            counts["inserted" if inserted else "existing"] += 1
+            loaded_files.append(file_stat)
+        manifest.mark_loaded(loaded_files)
+        batch.clear()
+
+    for row in iter_image_rows(base_dir, counts, partition):
+        file_stat = row[4]
+        if not full_reload and manifest.is_loaded(*file_stat):
+            counts["already_loaded"] += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    print(f"⏭️ Skipped {counts['already_loaded']} images already recorded in the load manifest, "
+          f"{counts['existing']} already present in raw_telegram_images.")
+    if orphan_message_ids:
+        sample = ", ".join(str(message_id) for message_id in sorted(orphan_message_ids)[:20])
+        print(f"⚠️ {len(orphan_message_ids)} message_ids have images but do not exist in raw_telegram_messages "
+              f"(e.g. {sample}). Skipped their images.")
+    return counts["inserted"], counts["skipped"]
+
+
+def main(full_reload=False, partition=None):
+    conn = psycopg2.connect(
+        dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
+    )
+    print(f"Connected to DB {DB_NAME} on {DB_HOST}:{DB_PORT} as {DB_USER}")
+    ensure_raw_table(conn)
+
+    manifest = LoadManifest("raw_telegram_images")
+    if full_reload:
+        print("🔁 Full reload requested, ignoring the load manifest.")
+    if partition:
+        print(f"📂 Loading only partition {partition[0]}/{partition[1]}.")
+
+    inserted_count, skipped_count = load_images(conn, root_dir, manifest, full_reload, partition=partition)
+
+    manifest.close()
+    conn.close()
+    print(f"✅ Finished loading raw telegram images. Inserted: {inserted_count}, Skipped: {skipped_count}")
+
 
-            try:
-                cur.execute("""
-                    INSERT INTO raw_telegram_images 
-                        (message_id, channel_username, image_path, image_date)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT DO NOTHING;
-                """, (
-                    message_id,
-                    channel,
-                    file_path,
-                    image_date
-                ))
-                inserted_count += 1
-            except Exception as e:
-                conn.rollback()
-                print(f"❌ Failed to insert {file_path}: {e}")
-                skipped_count += 1
-            else:
-                conn.commit()
-
-cur.close()
-conn.close()
-print(f"✅ Finished loading raw telegram images. Inserted: {inserted_count}, Skipped: {skipped_count}")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load raw Telegram image paths into Postgres.")
+    parser.add_argument("--full-reload", action="store_true",
+                        help="Reprocess every image, ignoring the local load manifest.")
+    parser.add_argument("--date", help="Only load the <date> partition (YYYY-MM-DD); requires --channel.")
+    parser.add_argument("--channel", help="Only load the <channel> partition; requires --date.")
+    args = parser.parse_args()
+    if bool(args.date) != bool(args.channel):
+        parser.error("--date and --channel must be given together")
+    main(full_reload=args.full_reload, partition=(args.date, args.channel) if args.date else None)
@@ -1,10 +1,18 @@
 import os
+import io
+import csv
 import json
+import time
+import argparse
 import psycopg2
 from psycopg2.extras import Json
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
+from parallel_scan import scan_partitions, scan_files, chunked, bounded_parallel_map
+from load_manifest import LoadManifest
+
 load_dotenv()
 
 DB_NAME = os.getenv("POSTGRES_DB", "postgres")
@@ -13,59 +21,349 @@ DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
 DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
 DB_PORT = os.getenv("POSTGRES_PORT", "5432")
 
-conn = psycopg2.connect(
-    dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
+root_dir = os.getenv("RAW_MESSAGES_DIR", "C:/Users/techin/telegram-medical-data-pipeline/data/raw/telegram_messages")
+
+# Load mode: 'bulk' COPYs batches into a temp table and upserts set-based, 'row' is the old per-row INSERT
+LOAD_MODE = os.getenv("LOAD_MODE", "bulk")
+BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", "5000"))
+REJECT_FILE = os.getenv(
+    "LOAD_REJECT_FILE", f"data/rejects/raw_telegram_messages_{datetime.now().strftime('%Y-%m-%d')}.jsonl"
 )
-cur = conn.cursor()
-
-# ✅ Check connected database immediately
-cur.execute("SELECT current_database();")
-print("Connected to database:", cur.fetchone()[0])
-
-root_dir = "C:/Users/techin/telegram-medical-data-pipeline/data/raw/telegram_messages"
-
-for date_dir in os.listdir(root_dir):
-    date_path = os.path.join(root_dir, date_dir)
-    if os.path.isdir(date_path):
-        for channel in os.listdir(date_path):
-            channel_path = os.path.join(date_path, channel)
-            if os.path.isdir(channel_path):
-                for file in os.listdir(channel_path):
-                    if file.endswith(".json"):
-                        file_path = os.path.join(channel_path, file)
-                        with open(file_path, "r", encoding="utf-8") as f:
-                            data = json.load(f)
-                            message_id = data.get("id") or data.get("message_id")
-                            if not message_id:
-                                print(f"⚠️ No message_id in {file_path}, skipping...")
-                                continue
-                            message_timestamp = data.get("date")
-                            if isinstance(message_timestamp, str):
-                                try:
-                                    message_timestamp = datetime.fromisoformat(message_timestamp)
-                                except Exception:
-                                    print(f"⚠️ Bad timestamp in {file_path}, using now.")
-                                    message_timestamp = datetime.utcnow()
-                            elif message_timestamp is None:
-                                message_timestamp = datetime.utcnow()
-                            try:
-                                cur.execute("""
-                                    INSERT INTO raw_telegram_messages 
-                                        (message_id, channel_username, message_timestamp, raw_json)
-                                    VALUES (%s, %s, %s, %s)
-                                    ON CONFLICT (message_id) DO NOTHING;
-                                """, (
-                                    message_id,
-                                    channel,
-                                    message_timestamp,
-                                    Json(data)
-                                ))
-                            except Exception as e:
-                                conn.rollback()
-                                print(f"❌ Failed to insert {file_path}: {e}")
-                            else:
-                                conn.commit()
-
-cur.close()
-conn.close()
-print("✅ Finished loading raw telegram messages.")
\ No newline at end of file
+
+# Parsing runs in a process pool; the main process is the single DB writer
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", str(os.cpu_count() or 1)))
+PARSE_CHUNK_SIZE = int(os.getenv("LOAD_PARSE_CHUNK_SIZE", "500"))  # files per parse task
+MAX_PENDING_CHUNKS = LOAD_WORKERS * 4
+
+MESSAGE_FILE_SUFFIXES = (".json", ".jsonl", ".parquet")
+
+COLUMNS = ("message_id", "channel_username", "message_timestamp", "raw_json")
+INT_FIELDS = ("id", "sender_id", "views")  # integer message fields, possibly null
+
+# Re-scraped and edited messages replace the stored row when their JSON changed, unless they
+# are older than it (earlier edit_date, or same edit_date with fewer views, e.g. an old archive
+# replayed by --full-reload). loaded_at moves with every change so staging picks the row up again.
+UPSERT_CONFLICT_SQL = """
+    ON CONFLICT (message_id) DO UPDATE SET
+        channel_username = EXCLUDED.channel_username,
+        message_timestamp = EXCLUDED.message_timestamp,
+        raw_json = EXCLUDED.raw_json,
+        loaded_at = now()
+    WHERE raw_telegram_messages.raw_json IS DISTINCT FROM EXCLUDED.raw_json
+      AND (COALESCE(EXCLUDED.raw_json->>'edit_date', ''), COALESCE((EXCLUDED.raw_json->>'views')::bigint, 0))
+          >= (COALESCE(raw_telegram_messages.raw_json->>'edit_date', ''),
+              COALESCE((raw_telegram_messages.raw_json->>'views')::bigint, 0))
+"""
+
+
+def ensure_raw_table(conn):
+    """Adds the loaded_at change timestamp that staging reads incrementally."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            ALTER TABLE raw_telegram_messages
+                ADD COLUMN IF NOT EXISTS loaded_at TIMESTAMPTZ NOT NULL DEFAULT now();
+            CREATE INDEX IF NOT EXISTS raw_telegram_messages_loaded_at_idx
+                ON raw_telegram_messages (loaded_at);
+        """)
+    conn.commit()
+
+
+def restore_int_fields(record):
+    """
+    Older Parquet part files stored integer columns containing nulls (e.g. views of service
+    messages) as float64; turn 123.0 back into 123 so ::bigint / ::INTEGER casts downstream work.
+    """
+    for field in INT_FIELDS:
+        value = record.get(field)
+        if isinstance(value, float) and value.is_integer():
+            record[field] = int(value)
+    return record
+
+
+def iter_file_records(file_path):
+    """Yields message dicts from a legacy <id>.json file or a JSONL / Parquet partition file."""
+    if file_path.endswith(".jsonl"):
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif file_path.endswith(".parquet"):
+        import pyarrow.parquet as pq  # only needed when the scraper wrote Parquet partitions
+        # to_pylist gives plain Python values (ints stay ints, nulls become None) for psycopg2
+        for record in pq.read_table(file_path).to_pylist():
+            yield restore_int_fields(record)
+    else:
+        with open(file_path, "r", encoding="utf-8") as f:
+            yield json.load(f)
+
+
+def iter_message_chunks(base_dir, manifest, full_reload=False, partition=None):
+    """
+    Yields (channel, [(path, mtime, size), ...]) parse tasks for every partition under
+    <date>/<channel>/ (or just the given (date, channel) partition), leaving out files
+    the manifest already has unless full_reload is set.
+    """
+    skipped = 0
+    for _, channel, channel_path in scan_partitions(base_dir, partition):
+        files = scan_files(channel_path, MESSAGE_FILE_SUFFIXES)
+        if not full_reload:
+            new_files = [f for f in files if not manifest.is_loaded(*f)]
+            skipped += len(files) - len(new_files)
+            files = new_files
+        for chunk in chunked(files, PARSE_CHUNK_SIZE):
+            yield channel, chunk
+    print(f"⏭️ Skipped {skipped} files already recorded in the load manifest.")
+
+
+def strip_nul(value):
+    """Removes NUL characters from every string in a decoded JSON value; Postgres JSONB rejects them."""
+    if isinstance(value, str):
+        return value.replace("\x00", "")
+    if isinstance(value, dict):
+        return {strip_nul(key): strip_nul(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [strip_nul(item) for item in value]
+    return value
+
+
+def parse_message(data, channel, file_path):
+    """Turns a scraped message dict into a raw_telegram_messages row, or returns (None, reason)."""
+    message_id = data.get("id") or data.get("message_id")
+    if not message_id:
+        return None, "No message_id"
+    try:
+        message_id = int(message_id)
+    except (TypeError, ValueError):
+        return None, f"Non-integer message_id {message_id!r}"
+    message_timestamp = data.get("date")
+    if isinstance(message_timestamp, str):
+        try:
+            message_timestamp = datetime.fromisoformat(message_timestamp)
+        except Exception:
+            print(f"⚠️ Bad timestamp in {file_path}, using now.")
+            message_timestamp = datetime.utcnow()
+    elif message_timestamp is None:
+        message_timestamp = datetime.utcnow()
+    return (message_id, channel, message_timestamp, strip_nul(data)), None
+
+
+def write_rejects(rejects):
+    if not rejects:
+        return
+    os.makedirs(os.path.dirname(REJECT_FILE) or ".", exist_ok=True)
+    with open(REJECT_FILE, "a", encoding="utf-8") as f:
+        for file_path, reason, record in rejects:
+            f.write(json.dumps({"file_path": file_path, "reason": reason, "record": record},
+                               ensure_ascii=False, default=str))
+            f.write("\n")
+
+
+def parse_file_chunk(channel, files):
+    """Worker task: parses a chunk of files, returning (files, [(file_path, row), ...], [reject, ...])."""
+    rows = []
+    rejects = []
+    for file_path, _, _ in files:
+        try:
+            records = list(iter_file_records(file_path))
+        except Exception as e:
+            rejects.append((file_path, f"Unreadable file: {e}", None))
+            continue
+        for data in records:
+            row, reason = parse_message(data, channel, file_path)
+            if row is None:
+                print(f"⚠️ {reason} in {file_path}, skipping...")
+                rejects.append((file_path, reason, data))
+                continue
+            rows.append((file_path, row))
+    return files, rows, rejects
+
+
+def iter_parsed_chunks(base_dir, manifest, full_reload, rejects, partition=None):
+    """Yields (files, [(file_path, row), ...]) per parsed chunk, collecting failures into rejects."""
+    with ProcessPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        for files, rows, chunk_rejects in bounded_parallel_map(
+            executor, parse_file_chunk, iter_message_chunks(base_dir, manifest, full_reload, partition),
+            MAX_PENDING_CHUNKS
+        ):
+            rejects.extend(chunk_rejects)
+            yield files, rows
+
+
+# --- Row-by-row mode (original behaviour) ---
+def load_row_by_row(conn, base_dir, manifest, full_reload=False, partition=None):
+    cur = conn.cursor()
+    rejects = []
+    loaded = 0
+    for files, rows in iter_parsed_chunks(base_dir, manifest, full_reload, rejects, partition):
+        failed_files = set()
+        for file_path, row in rows:
+            message_id, channel, message_timestamp, data = row
+            try:
+                cur.execute("""
+                    INSERT INTO raw_telegram_messages
+                        (message_id, channel_username, message_timestamp, raw_json)
+                    VALUES (%s, %s, %s, %s)
+                """ + UPSERT_CONFLICT_SQL, (
+                    message_id,
+                    channel,
+                    message_timestamp,
+                    Json(data)
+                ))
+            except Exception as e:
+                conn.rollback()
+                print(f"❌ Failed to insert {file_path}: {e}")
+                rejects.append((file_path, str(e), data))
+                failed_files.add(file_path)
+            else:
+                conn.commit()
+                loaded += 1
+        # Files with failed inserts stay out of the manifest so the next run retries them
+        manifest.mark_loaded(f for f in files if f[0] not in failed_files)
+    cur.close()
+    write_rejects(rejects)
+    return loaded, len(rejects)
+
+
+# --- Bulk mode ---
+def rows_to_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for message_id, channel, message_timestamp, data in rows:
+        raw_json = json.dumps(data, ensure_ascii=False, default=str)
+        writer.writerow((message_id, channel, message_timestamp.isoformat(), raw_json))
+    buffer.seek(0)
+    return buffer
+
+
+def copy_batch(conn, batch):
+    """COPYs one batch into the temp table and upserts it; returns the number of new or changed rows."""
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE tmp_raw_telegram_messages;")
+        cur.copy_expert(
+            f"COPY tmp_raw_telegram_messages ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            rows_to_csv(row for _, row in batch)
+        )
+        cur.execute(f"""
+            INSERT INTO raw_telegram_messages ({', '.join(COLUMNS)})
+            SELECT DISTINCT ON (message_id) {', '.join(COLUMNS)}
+            FROM tmp_raw_telegram_messages
+            -- Latest version of a message that occurs more than once in the batch
+            ORDER BY message_id, raw_json->>'edit_date' DESC NULLS LAST, (raw_json->>'views')::bigint DESC NULLS LAST
+        """ + UPSERT_CONFLICT_SQL)
+        inserted = cur.rowcount
+    conn.commit()
+    return inserted
+
+
+def copy_batch_bisecting(conn, batch, rejects, failed_files):
+    """
+    Loads a batch, splitting it in halves when a row is bad (e.g. invalid JSON for JSONB) until
+    the offending rows are isolated; those go to the reject file and the rest still loads.
+    """
+    try:
+        return copy_batch(conn, batch)
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        conn.rollback()
+        if len(batch) == 1:
+            file_path, row = batch[0]
+            print(f"❌ Failed to load message {row[0]} from {file_path}: {e}")
+            rejects.append((file_path, str(e).strip(), row[3]))
+            failed_files.add(file_path)
+            return 0
+    middle = len(batch) // 2
+    return (copy_batch_bisecting(conn, batch[:middle], rejects, failed_files)
+            + copy_batch_bisecting(conn, batch[middle:], rejects, failed_files))
+
+
+def load_bulk(conn, base_dir, manifest, full_reload=False, batch_size=BATCH_SIZE, partition=None):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS tmp_raw_telegram_messages
+            AS SELECT {', '.join(COLUMNS)} FROM raw_telegram_messages WITH NO DATA;
+        """)
+    conn.commit()
+
+    rejects = []
+    loaded = 0
+    batch = []
+    # Files whose rows have all been appended to a batch; recorded in the manifest on the next commit
+    pending_files = []
+    # Files with rejected rows stay out of the manifest so the next run retries them
+    failed_files = set()
+    start = time.monotonic()
+
+    def flush():
+        nonlocal loaded
+        try:
+            if batch:
+                loaded += copy_batch_bisecting(conn, batch, rejects, failed_files)
+        except Exception as e:
+            # Not a bad row (e.g. the connection dropped): the batch goes to the reject file
+            # and the rest of the load continues. Its files stay out of the manifest.
+            conn.rollback()
+            print(f"❌ Failed to load batch of {len(batch)} rows: {e}")
+            rejects.extend((file_path, f"Batch failed: {e}", row[3]) for file_path, row in batch)
+            failed_files.update(file_path for file_path, _ in batch)
+        manifest.mark_loaded(f for f in pending_files if f[0] not in failed_files)
+        pending_files.clear()
+        elapsed = time.monotonic() - start
+        print(f"📦 {loaded} rows upserted so far ({loaded / elapsed if elapsed else 0:.0f} rows/s)")
+        batch.clear()
+
+    for files, rows in iter_parsed_chunks(base_dir, manifest, full_reload, rejects, partition):
+        for file_path, row in rows:
+            batch.append((file_path, row))
+            if len(batch) >= batch_size:
+                flush()
+        pending_files.extend(files)
+    if batch or pending_files:
+        flush()
+
+    write_rejects(rejects)
+    return loaded, len(rejects)
+
+
+def main(full_reload=False, partition=None):
+    conn = psycopg2.connect(
+        dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
+    )
+    cur = conn.cursor()
+
+    # ✅ Check connected database immediately
+    cur.execute("SELECT current_database();")
+    print("Connected to database:", cur.fetchone()[0])
+    cur.close()
+    ensure_raw_table(conn)
+
+    manifest = LoadManifest("raw_telegram_messages")
+    if full_reload:
+        print("🔁 Full reload requested, ignoring the load manifest.")
+    if partition:
+        print(f"📂 Loading only partition {partition[0]}/{partition[1]}.")
+
+    start = time.monotonic()
+    if LOAD_MODE == "row":
+        loaded, rejected = load_row_by_row(conn, root_dir, manifest, full_reload, partition)
+    else:
+        loaded, rejected = load_bulk(conn, root_dir, manifest, full_reload, partition=partition)
+    elapsed = time.monotonic() - start
+
+    manifest.close()
+    conn.close()
+    print(f"✅ Finished loading raw telegram messages ({LOAD_MODE} mode). "
+          f"New or changed rows: {loaded}, Rejected: {rejected}, "
+          f"{elapsed:.1f}s ({loaded / elapsed if elapsed else 0:.0f} rows/s)")
+    if rejected:
+        print(f"⚠️ Rejected rows written to {REJECT_FILE}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load raw Telegram messages into Postgres.")
+    parser.add_argument("--full-reload", action="store_true",
+                        help="Reprocess every file, ignoring the local load manifest.")
+    parser.add_argument("--date", help="Only load the <date> partition (YYYY-MM-DD); requires --channel.")
+    parser.add_argument("--channel", help="Only load the <channel> partition; requires --date.")
+    args = parser.parse_args()
+    if bool(args.date) != bool(args.channel):
+        parser.error("--date and --channel must be given together")
+    main(full_reload=args.full_reload, partition=(args.date, args.channel) if args.date else None)
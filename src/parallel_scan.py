@@ -0,0 +1,62 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+def scan_partitions(base_dir, partition=None):
+    """
+    Yields (date_dir, channel, channel_path) for every <date>/<channel>/ directory under base_dir,
+    or only for the given (date_dir, channel) partition if it exists.
+    """
+    if partition is not None:
+        date_dir, channel = partition
+        channel_path = os.path.join(base_dir, date_dir, channel)
+        if os.path.isdir(channel_path):
+            yield date_dir, channel, channel_path
+        return
+    with os.scandir(base_dir) as date_entries:
+        for date_entry in date_entries:
+            if not date_entry.is_dir():
+                continue
+            with os.scandir(date_entry.path) as channel_entries:
+                for channel_entry in channel_entries:
+                    if channel_entry.is_dir():
+                        yield date_entry.name, channel_entry.name, channel_entry.path
+
+
+def scan_files(channel_path, suffixes):
+    """
+    Returns (path, mtime, size) for files in channel_path ending with one of suffixes,
+    skipping hidden/temp files. Stats come from the scandir entries (cached on Windows).
+    """
+    files = []
+    with os.scandir(channel_path) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(suffixes) and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((entry.path, stat.st_mtime, stat.st_size))
+    return files
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bounded_parallel_map(executor, fn, tasks, max_pending):
+    """
+    Submits fn(*task) for each task to executor and yields results as they complete.
+
+    At most max_pending tasks are in flight, so a slow consumer (the single DB writer)
+    applies backpressure to the scan instead of results piling up in memory.
+    """
+    pending = set()
+    for task in tasks:
+        pending.add(executor.submit(fn, *task))
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
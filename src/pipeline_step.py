@@ -0,0 +1,20 @@
+import os
+import sys
+import asyncio
+import inspect
+import importlib
+
+
+def call(project_root, relative_dir, module_name, function_name, args=(), kwargs=None):
+    """
+    Imports one of the pipeline scripts as a module and calls one of its functions; coroutine
+    functions are run to completion. Meant to run in a process whose working directory is
+    already project_root (see dags/repository.py), where the scripts' relative data/ paths resolve.
+    """
+    module_dir = os.path.join(project_root, relative_dir)
+    if module_dir not in sys.path:
+        sys.path.insert(0, module_dir)
+    result = getattr(importlib.import_module(module_name), function_name)(*args, **(kwargs or {}))
+    if inspect.iscoroutine(result):
+        result = asyncio.run(result)
+    return result
@@ -0,0 +1,157 @@
+import os
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+STORE_PATH = os.getenv('IMAGE_STORE_PATH', 'data/raw/image_store')
+INDEX_PATH = os.getenv('IMAGE_STORE_INDEX_PATH', 'data/state/image_store_index.sqlite')
+VARIANT_SIZE = int(os.getenv('IMAGE_VARIANT_SIZE', '640'))  # keep equal to the detector's DETECTION_IMAGE_SIZE
+
+
+def content_path(store_path, content_hash):
+    return os.path.join(store_path, content_hash[:2], f"{content_hash}.jpg")
+
+
+def variant_path(store_path, content_hash, size):
+    return os.path.join(store_path, content_hash[:2], f"{content_hash}_{size}.jpg")
+
+
+def unique_temp_path(path, suffix):
+    """Hidden sibling of path, unique per call, so concurrent writers of the same path never share a temp file."""
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f".{filename}.{uuid.uuid4().hex}{suffix}")
+
+
+class ImageStore:
+    """
+    Content-addressed image store: each distinct image is kept once under <store>/<hh>/<sha256>.jpg,
+    together with a copy resized to VARIANT_SIZE on its longest side for the detector.
+
+    The per-message path (data/raw/telegram_images/<date>/<channel>/message_<id>_<photo>.jpg) stays
+    in place as a hard link to the stored file, so the loaders and detector keep working unchanged
+    while reposted images take disk space only once. A SQLite path index maps every such path to
+    its content hash.
+    """
+
+    def __init__(self, store_path=STORE_PATH, index_path=INDEX_PATH, variant_size=VARIANT_SIZE):
+        self.store_path = store_path
+        self.variant_size = variant_size
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        # put() runs on worker threads (asyncio.to_thread), so the connection is shared under a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(index_path, timeout=60, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS image_files (
+                image_path TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                stored_at TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS image_files_content_hash_idx ON image_files (content_hash)")
+        self.conn.commit()
+
+    @staticmethod
+    def index_key(image_path):
+        return image_path.replace("\\", "/")
+
+    @staticmethod
+    def temp_path(image_path):
+        """Download target next to image_path; hidden and without an image suffix so loaders skip it."""
+        return unique_temp_path(image_path, ".part")
+
+    def has(self, image_path):
+        """True if image_path is already indexed and on disk, so its download can be skipped."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM image_files WHERE image_path = ?", (self.index_key(image_path),)
+            ).fetchone()
+        return row is not None and os.path.exists(image_path)
+
+    def put(self, downloaded_path, image_path):
+        """
+        Moves a downloaded file into the store (or discards it if the content is already stored),
+        links image_path to the stored file and records it in the index.
+        Returns (content_hash, is_new).
+
+        Safe to call concurrently for the same content or the same image_path (e.g. a crawl and the
+        listener storing one post): the stored file and the link are only ever swapped in with
+        os.replace, and a stored file that appears meanwhile counts as already stored.
+        """
+        digest = hashlib.sha256()
+        with open(downloaded_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+
+        stored_path = content_path(self.store_path, content_hash)
+        is_new = not os.path.exists(stored_path)
+        if is_new:
+            os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+            try:
+                # Same bytes either way, so replacing a copy another put just stored is harmless
+                os.replace(downloaded_path, stored_path)
+            except OSError:
+                # e.g. Windows refuses to replace a file that is open; fine if it's stored already
+                if not os.path.exists(stored_path):
+                    raise
+                is_new = False
+        if is_new:
+            try:
+                self.write_variant(stored_path, content_hash)
+            except Exception as e:
+                logging.warning(f"Could not write resized variant of {stored_path}: {e}")
+        else:
+            os.remove(downloaded_path)
+
+        # Link under a unique name and swap it in, so image_path always exists once put() returns
+        link_path = unique_temp_path(image_path, ".link")
+        try:
+            os.link(stored_path, link_path)
+        except OSError:
+            # No hard links across devices / on some filesystems; fall back to a plain copy
+            shutil.copyfile(stored_path, link_path)
+        os.replace(link_path, image_path)
+        if os.path.lexists(link_path):
+            # rename() is a no-op when both names already link the same file, leaving link_path behind
+            os.remove(link_path)
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO image_files (image_path, content_hash, stored_at) VALUES (?, ?, ?)",
+                (self.index_key(image_path), content_hash, datetime.now().isoformat())
+            )
+            self.conn.commit()
+        return content_hash, is_new
+
+    def write_variant(self, stored_path, content_hash):
+        """Writes the detector-sized copy; images already within variant_size don't need one."""
+        try:
+            import cv2  # opencv is already a pipeline dependency (detector)
+        except ImportError:
+            logging.warning("opencv not installed, skipping resized image variants.")
+            return
+        image = cv2.imread(stored_path)
+        if image is None:
+            logging.warning(f"Could not decode {stored_path}, no resized variant written.")
+            return
+        height, width = image.shape[:2]
+        scale = self.variant_size / max(height, width)
+        if scale >= 1:
+            return
+        resized = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        target = variant_path(self.store_path, content_hash, self.variant_size)
+        tmp_path = unique_temp_path(target, ".jpg")  # cv2 picks the encoder from the suffix
+        try:
+            if not cv2.imwrite(tmp_path, resized, [cv2.IMWRITE_JPEG_QUALITY, 90]):
+                raise OSError(f"cv2.imwrite failed for {tmp_path}")
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def close(self):
+        self.conn.close()
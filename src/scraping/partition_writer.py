@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import asyncio
+import logging
+
+# Output formats
+FORMAT_JSON = 'json'        # legacy layout: one indented <id>.json file per message
+FORMAT_JSONL = 'jsonl'      # newline-delimited JSON part files per date/channel partition
+FORMAT_PARQUET = 'parquet'  # Parquet part files per date/channel partition (needs pandas + pyarrow)
+OUTPUT_FORMATS = (FORMAT_JSON, FORMAT_JSONL, FORMAT_PARQUET)
+
+
+class PartitionWriter:
+    """
+    Writes scraped messages under <base_path>/<date>/<channel>/.
+
+    In the 'json' compatibility mode every message goes to its own <id>.json file. In the
+    'jsonl' and 'parquet' modes messages are buffered per partition and flushed as compact
+    part files, written to a temporary name and atomically renamed so readers never see a
+    half-written file.
+    """
+
+    def __init__(self, base_path, output_format=FORMAT_JSON, flush_size=1000):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+        self.base_path = base_path
+        self.output_format = output_format
+        self.flush_size = flush_size
+        self.buffers = {}
+        self.created_dirs = set()
+        self.part_seq = 0
+        self.files_written = 0
+
+    def ensure_dir(self, path):
+        # Cache created directories so we don't hit os.makedirs for every message
+        if path not in self.created_dirs:
+            os.makedirs(path, exist_ok=True)
+            self.created_dirs.add(path)
+        return path
+
+    def partition_path(self, date_str, channel_name):
+        return self.ensure_dir(os.path.join(self.base_path, date_str, channel_name))
+
+    def write(self, message_data, date_str, channel_name):
+        if self.output_format == FORMAT_JSON:
+            message_filepath = os.path.join(self.partition_path(date_str, channel_name), f'{message_data["id"]}.json')
+            with open(message_filepath, 'w', encoding='utf-8') as f:
+                json.dump(message_data, f, ensure_ascii=False, indent=4)
+            self.files_written += 1
+            return
+
+        key = (date_str, channel_name)
+        buffer = self.buffers.setdefault(key, [])
+        buffer.append(message_data)
+        if len(buffer) >= self.flush_size:
+            self.flush_partition(key)
+
+    def take_partition(self, key):
+        """Removes a partition's buffered records and names their part file; returns (records, final_path)."""
+        records = self.buffers.pop(key, None)
+        if not records:
+            return None
+        date_str, channel_name = key
+        self.part_seq += 1
+        part_name = f"part-{time.time_ns()}-{self.part_seq:05d}.{self.output_format}"
+        return records, os.path.join(self.partition_path(date_str, channel_name), part_name)
+
+    def write_part(self, records, final_path):
+        partition_dir, part_name = os.path.split(final_path)
+        tmp_path = os.path.join(partition_dir, f".{part_name}.tmp")
+
+        if self.output_format == FORMAT_JSONL:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+                    f.write('\n')
+        else:
+            import pandas as pd  # optional dependency, only needed for Parquet output
+            # Nullable dtypes keep int columns with nulls (e.g. views of service messages) as int64, not float64
+            pd.DataFrame.from_records(records).convert_dtypes().to_parquet(tmp_path, index=False)
+
+        os.replace(tmp_path, final_path)
+        logging.info(f"Flushed {len(records)} messages to {final_path}")
+
+    def flush_partition(self, key):
+        part = self.take_partition(key)
+        if part:
+            self.write_part(*part)
+            self.files_written += 1
+
+    def flush(self):
+        for key in list(self.buffers):
+            self.flush_partition(key)
+
+    async def flush_async(self):
+        """Like flush(), but the part files are written on a worker thread so the event loop keeps running."""
+        parts = [part for part in map(self.take_partition, list(self.buffers)) if part]
+        for part in parts:
+            await asyncio.to_thread(self.write_part, *part)
+            self.files_written += 1
+        return True
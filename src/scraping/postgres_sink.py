@@ -0,0 +1,203 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from itertools import islice
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+
+DB_NAME = os.getenv("POSTGRES_DB", "postgres")
+DB_USER = os.getenv("POSTGRES_USER", "postgres")
+DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
+DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
+DB_PORT = os.getenv("POSTGRES_PORT", "5432")
+
+# Same relative image path the image loader registers, so both ingestion paths agree on keys
+IMAGE_PATH_PREFIX = "data/raw/telegram_images"
+
+# Same conflict rule as src/load_raw_messages.py: a changed version replaces the stored row unless
+# it is older (earlier edit_date, or same edit_date with fewer views); loaded_at marks the change
+UPSERT_MESSAGES_SQL = """
+    INSERT INTO raw_telegram_messages (message_id, channel_username, message_timestamp, raw_json)
+    VALUES %s
+    ON CONFLICT (message_id) DO UPDATE SET
+        channel_username = EXCLUDED.channel_username,
+        message_timestamp = EXCLUDED.message_timestamp,
+        raw_json = EXCLUDED.raw_json,
+        loaded_at = now()
+    WHERE raw_telegram_messages.raw_json IS DISTINCT FROM EXCLUDED.raw_json
+      AND (COALESCE(EXCLUDED.raw_json->>'edit_date', ''), COALESCE((EXCLUDED.raw_json->>'views')::bigint, 0))
+          >= (COALESCE(raw_telegram_messages.raw_json->>'edit_date', ''),
+              COALESCE((raw_telegram_messages.raw_json->>'views')::bigint, 0))
+"""
+
+
+class PostgresSink:
+    """
+    Streams scraped messages straight into raw_telegram_messages (and photo rows into
+    raw_telegram_images), batching inserts by size and age instead of round-tripping through files.
+
+    One sink, with one connection, serves every channel a process scrapes. write() only buffers;
+    batches are inserted by flush_async() on a worker thread so the event loop keeps running during
+    database round trips. A batch is started once batch_size messages are buffered, and a timer
+    started by start() flushes every flush_interval seconds, so rows never wait longer than that.
+
+    Has the same write/ensure_dir interface as PartitionWriter. When an archive PartitionWriter is
+    given, every message is also written to the data lake as before. Messages are upserted with the
+    file loader's rule, so re-scrapes and edits replace the stored row and the archive can be replayed.
+    """
+
+    def __init__(self, archive=None, batch_size=500, flush_interval=5.0, max_pending=50000):
+        self.archive = archive
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # seconds; bounds how stale buffered rows can get
+        self.max_pending = max_pending  # messages kept for retry while the database is unreachable
+        # message_id -> (message row, image row or None); keyed so an upsert never touches a row twice,
+        # and an image always travels (and is dropped) together with its message
+        self.messages = {}
+        self.created_dirs = set()
+        self.messages_written = 0
+        self.images_written = 0
+        # Messages dropped on overflow; once set, flushes report failure for the rest of the process
+        # so no checkpoint moves past rows that never reached the database
+        self.dropped = 0
+        self.conn = None  # opened on the flush thread
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+        self.timer_task = None
+        self.closing = asyncio.Event()
+
+    @property
+    def pending(self):
+        """Messages still buffered, e.g. because the last flush failed."""
+        return len(self.messages)
+
+    @property
+    def files_written(self):
+        return self.archive.files_written if self.archive else 0
+
+    def ensure_dir(self, path):
+        if self.archive:
+            return self.archive.ensure_dir(path)
+        if path not in self.created_dirs:
+            os.makedirs(path, exist_ok=True)
+            self.created_dirs.add(path)
+        return path
+
+    def start(self):
+        """Starts the flush timer; must be called from the running event loop."""
+        self.timer_task = asyncio.create_task(self.flush_periodically())
+
+    async def flush_periodically(self):
+        while not self.closing.is_set():
+            try:
+                await asyncio.wait_for(self.closing.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                await self.flush_async()
+
+    def write(self, message_data, date_str, channel_name):
+        if self.archive:
+            self.archive.write(message_data, date_str, channel_name)
+
+        message_timestamp = datetime.fromisoformat(message_data["date"])
+        row = (message_data["id"], channel_name, message_timestamp, Json(message_data))
+        image = None
+        if message_data.get("media_type") == "photo" and message_data.get("file_path"):
+            image_path = os.path.join(IMAGE_PATH_PREFIX, date_str, channel_name, os.path.basename(message_data["file_path"]))
+            image = (message_data["id"], channel_name, image_path, message_timestamp.date())
+        self.messages[message_data["id"]] = (row, image)
+
+        if self.pending >= self.batch_size and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = asyncio.create_task(self.flush_async())
+
+    def insert_batch(self, entries):
+        """Upserts messages, then inserts their images, in one transaction. Runs on a worker thread."""
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(
+                dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
+            )
+            # The upsert stamps loaded_at, which older raw tables don't have yet
+            with self.conn.cursor() as cur:
+                cur.execute("ALTER TABLE raw_telegram_messages ADD COLUMN IF NOT EXISTS loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()")
+            self.conn.commit()
+        messages = [row for row, _ in entries]
+        images = [image for _, image in entries if image]
+        try:
+            with self.conn.cursor() as cur:
+                execute_values(cur, UPSERT_MESSAGES_SQL, messages, page_size=len(messages))
+                upserted_messages = cur.rowcount
+                inserted_images = 0
+                # Images go in after their parent messages so the parent check in the loader holds here too
+                if images:
+                    execute_values(cur, """
+                        INSERT INTO raw_telegram_images (message_id, channel_username, image_path, image_date)
+                        VALUES %s
+                        ON CONFLICT DO NOTHING
+                    """, images, page_size=len(images))
+                    inserted_images = cur.rowcount
+            self.conn.commit()
+        except Exception:
+            if not self.conn.closed:
+                self.conn.rollback()
+            raise
+        return upserted_messages, inserted_images
+
+    def restore(self, batch):
+        """Puts a failed batch back in front of the buffer; versions written meanwhile win."""
+        batch.update(self.messages)
+        self.messages = batch
+        overflow = self.pending - self.max_pending
+        if overflow > 0:
+            # Beyond max_pending the archive/file loader has to catch up
+            logging.error(f"Dropping the oldest {overflow} buffered messages (with their images) from the Postgres sink.")
+            self.dropped += overflow
+            for message_id in list(islice(self.messages, overflow)):
+                del self.messages[message_id]
+
+    async def flush_async(self):
+        """
+        Inserts everything buffered so far. Returns False if the insert failed (the rows are kept for
+        retry) or if messages were ever dropped from the buffer.
+        """
+        async with self.flush_lock:
+            if self.archive:
+                await self.archive.flush_async()
+            if not self.messages:
+                return not self.dropped
+            batch, self.messages = self.messages, {}
+            try:
+                upserted_messages, inserted_images = await asyncio.to_thread(self.insert_batch, list(batch.values()))
+            except asyncio.CancelledError:
+                self.restore(batch)
+                raise
+            except Exception as e:
+                logging.error(f"Failed to stream {len(batch)} messages to Postgres, will retry: {e}")
+                self.restore(batch)
+                return False
+
+        image_count = sum(1 for _, image in batch.values() if image)
+        logging.info(
+            f"Streamed {len(batch)} messages ({upserted_messages} new or changed) and "
+            f"{image_count} images ({inserted_images} new) to Postgres"
+        )
+        self.messages_written += upserted_messages
+        self.images_written += inserted_images
+        return not self.dropped
+
+    async def aclose(self):
+        """Stops the timer, flushes what's left and closes the connection; returns False if rows were not written."""
+        self.closing.set()
+        if self.timer_task:
+            await self.timer_task
+        if self.flush_task:
+            await self.flush_task
+        written = await self.flush_async()
+        if self.conn is not None:
+            await asyncio.to_thread(self.conn.close)
+        logging.info(f"Postgres sink closed: {self.messages_written} messages, {self.images_written} images written.")
+        if self.dropped:
+            logging.error(f"{self.dropped} messages were dropped from the Postgres sink after repeated failures.")
+        if self.pending:
+            logging.error(f"{self.pending} messages could not be streamed to Postgres.")
+        return written
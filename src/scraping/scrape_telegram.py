@@ -1,11 +1,17 @@
 import os
 import json
+import time
 import asyncio
-from datetime import datetime
-from telethon import TelegramClient
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from telethon import TelegramClient, events, utils
+from telethon.errors import FloodWaitError
 from dotenv import load_dotenv
 import logging
 
+from partition_writer import PartitionWriter
+from image_store import ImageStore
+
 # Set up logging
 today_str = datetime.now().strftime("%Y-%m-%d")
 log_dir = "logs"
@@ -26,6 +32,8 @@ load_dotenv()
 API_ID = int(os.getenv('TELEGRAM_API_ID'))
 API_HASH = os.getenv('TELEGRAM_API_HASH')
 SESSION_NAME = 'telegram_scraper_session'
+SESSION_LOCK_PATH = f'{SESSION_NAME}.lock'
+SESSION_LOCK_TIMEOUT = float(os.getenv('SCRAPE_SESSION_LOCK_TIMEOUT', '3600'))  # max seconds to wait for the session
 
 # Channels to scrape
 TELEGRAM_CHANNELS = [
@@ -39,93 +47,558 @@ TELEGRAM_CHANNELS = [
 DATA_LAKE_BASE_PATH = 'data/raw/telegram_messages'
 IMAGES_BASE_PATH = 'data/raw/telegram_images'
 
-async def scrape_channel(client, channel_entity, limit=None):
+# Concurrency settings
+SCRAPE_CONCURRENCY = int(os.getenv('SCRAPE_CONCURRENCY', '4'))  # channels scraped in parallel
+FLOOD_WAIT_MAX_RETRIES = int(os.getenv('FLOOD_WAIT_MAX_RETRIES', '5'))
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '4'))  # concurrent photo downloads per channel
+DOWNLOAD_QUEUE_SIZE = int(os.getenv('DOWNLOAD_QUEUE_SIZE', '32'))  # pending downloads before iteration blocks
+
+# Incremental scraping: per-channel high-water marks (last seen message id)
+CHECKPOINT_PATH = os.getenv('SCRAPE_CHECKPOINT_PATH', 'data/state/scrape_checkpoints.json')
+REFRESH_WINDOW_DAYS = int(os.getenv('SCRAPE_REFRESH_WINDOW_DAYS', '0'))  # re-fetch last K days for view counts
+FULL_CRAWL = os.getenv('SCRAPE_FULL_CRAWL', 'false').lower() == 'true'  # ignore checkpoints
+
+# Message output: 'json' (one file per message, legacy layout), 'jsonl' or 'parquet' part files
+OUTPUT_FORMAT = os.getenv('SCRAPE_OUTPUT_FORMAT', 'json')
+FLUSH_SIZE = int(os.getenv('SCRAPE_FLUSH_SIZE', '1000'))  # messages buffered per partition before a flush
+
+# Sink: 'files' writes the data lake only; 'postgres' streams rows straight into the raw tables
+SCRAPE_SINK = os.getenv('SCRAPE_SINK', 'files')
+SCRAPE_ARCHIVE = os.getenv('SCRAPE_ARCHIVE', 'true').lower() == 'true'  # with 'postgres', also write the data lake
+SINK_BATCH_SIZE = int(os.getenv('SCRAPE_SINK_BATCH_SIZE', '500'))
+SINK_FLUSH_INTERVAL = float(os.getenv('SCRAPE_SINK_FLUSH_INTERVAL', '5'))  # max seconds a row waits in the buffer
+
+# Content-addressed image store: dedups reposted images and keeps a detector-sized variant
+IMAGE_STORE_ENABLED = os.getenv('IMAGE_STORE_ENABLED', 'true').lower() == 'true'
+
+# Live listener: after the catch-up crawl, keep receiving new/edited posts as Telegram pushes them
+SCRAPE_LISTEN = os.getenv('SCRAPE_LISTEN', 'false').lower() == 'true'
+LISTEN_FLUSH_INTERVAL = float(os.getenv('SCRAPE_LISTEN_FLUSH_INTERVAL', '10'))  # max seconds before buffered posts are written
+
+# --- Session ---
+@asynccontextmanager
+async def session_lock(timeout=SESSION_LOCK_TIMEOUT):
+    """
+    Holds an exclusive lock on the Telegram session while it is connected. Using one auth key from
+    several connections at once can get the session invalidated, so concurrent partition runs (and
+    a running listener) take turns. Raises TimeoutError if the session stays busy for timeout seconds.
+    """
+    import fcntl  # POSIX only; the pipeline runs in the Linux container
+    with open(SESSION_LOCK_PATH, 'a') as lock_file:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Telegram session {SESSION_NAME} still in use after {timeout:.0f}s")
+                await asyncio.sleep(1)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# --- Checkpoints ---
+def load_checkpoints():
+    if not os.path.exists(CHECKPOINT_PATH):
+        return {}
+    try:
+        with open(CHECKPOINT_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Could not read checkpoints from {CHECKPOINT_PATH}, starting from scratch: {e}")
+        return {}
+
+def save_checkpoint(channel_name, last_message_id):
+    # Read-modify-write without awaiting, so concurrent channel tasks can't interleave
+    checkpoints = load_checkpoints()
+    checkpoints[channel_name] = {
+        "last_message_id": last_message_id,
+        "updated_at": datetime.now().isoformat()
+    }
+    os.makedirs(os.path.dirname(CHECKPOINT_PATH) or '.', exist_ok=True)
+    tmp_path = f"{CHECKPOINT_PATH}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoints, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+async def photo_download_worker(client, download_queue, download_stats, writer, image_store=None, on_written=None):
+    """
+    Consumes (message, message_data, date_str, channel_name, image_filepath) jobs until a None sentinel.
+    on_written(channel_name, message_id) is called once a message has been handed to the writer.
+    """
+    while True:
+        job = await download_queue.get()
+        try:
+            if job is None:
+                return
+            message, message_data, date_str, channel_name, image_filepath = job
+            try:
+                if image_store and image_store.has(image_filepath):
+                    # Re-crawled or edited post whose photo is already stored
+                    download_stats["skipped"] += 1
+                else:
+                    logging.info(f"Downloading image from message {message.id} to {image_filepath}")
+                    download_path = image_store.temp_path(image_filepath) if image_store else image_filepath
+                    await client.download_media(message.photo, file=download_path)
+                    download_stats["images"] += 1
+                    download_stats["bytes"] += os.path.getsize(download_path)
+                    if image_store:
+                        # Hashing and resizing are CPU/disk bound, keep them off the event loop
+                        _, is_new = await asyncio.to_thread(image_store.put, download_path, image_filepath)
+                        download_stats["deduplicated"] += 0 if is_new else 1
+                message_data["media_type"] = "photo"
+                message_data["file_path"] = image_filepath
+            except Exception as e:
+                download_stats["failed"] += 1
+                logging.error(f"Error downloading image from message {message.id}: {e}")
+            # Photo messages are written once their download settles so file_path is accurate.
+            # A writer error (e.g. a failed part-file flush) must not kill the worker, or the
+            # producer would block forever on the full queue once all workers are gone
+            try:
+                writer.write(message_data, date_str, channel_name)
+            except Exception as e:
+                download_stats["write_failed"] += 1
+                logging.error(f"Error writing message {message.id} from {channel_name}: {e}")
+                continue
+            if on_written:
+                on_written(channel_name, message.id)
+        finally:
+            download_queue.task_done()
+
+def build_message_data(message):
+    """Builds the lightweight JSON structure stored for each message."""
+    return {
+        "id": message.id,
+        "date": message.date.isoformat(),
+        "text": message.text,
+        "sender_id": message.sender_id,
+        "views": message.views,
+        "edit_date": message.edit_date.isoformat() if message.edit_date else None,
+        "media_type": None,
+        "file_path": None
+    }
+
+async def write_message(writer, download_queue, message, channel_name):
+    """Writes a message, or hands it to the download stage if it has a photo (the worker writes it then)."""
+    message_date_str = message.date.strftime('%Y-%m-%d')
+    message_data = build_message_data(message)
+    if message.photo:
+        image_date_path = writer.ensure_dir(os.path.join(IMAGES_BASE_PATH, message_date_str, channel_name))
+        image_filename = f"message_{message.id}_{message.photo.id}.jpg"
+        image_filepath = os.path.join(image_date_path, image_filename)
+        await download_queue.put((message, message_data, message_date_str, channel_name, image_filepath))
+    else:
+        writer.write(message_data, message_date_str, channel_name)
+    return message_data
+
+def new_download_stats():
+    return {"images": 0, "failed": 0, "bytes": 0, "deduplicated": 0, "skipped": 0, "write_failed": 0}
+
+def create_image_store():
+    return ImageStore() if IMAGE_STORE_ENABLED else None
+
+def create_writer():
+    """Returns the message writer for SCRAPE_SINK: a PartitionWriter, or a PostgresSink optionally archiving to one."""
+    if SCRAPE_SINK not in ('files', 'postgres'):
+        raise ValueError(f"Unknown SCRAPE_SINK '{SCRAPE_SINK}', expected 'files' or 'postgres'")
+    archive = None
+    if SCRAPE_SINK == 'files' or SCRAPE_ARCHIVE:
+        archive = PartitionWriter(DATA_LAKE_BASE_PATH, OUTPUT_FORMAT, FLUSH_SIZE)
+    if SCRAPE_SINK != 'postgres':
+        return archive
+    from postgres_sink import PostgresSink  # psycopg2 is only needed when streaming
+    sink = PostgresSink(archive, SINK_BATCH_SIZE, SINK_FLUSH_INTERVAL)
+    sink.start()
+    return sink
+
+async def flush_writer(writer):
+    """Flushes everything the writer buffered; returns False if rows could not be written yet."""
+    if hasattr(writer, "flush_async"):
+        return await writer.flush_async()
+    writer.flush()
+    return True
+
+async def close_writer(writer):
+    """Flushes and closes the writer; returns False if rows could not be written."""
+    if hasattr(writer, "aclose"):
+        return await writer.aclose()
+    writer.flush()
+    logging.info(f"Wrote {writer.files_written} message files.")
+    return True
+
+def log_download_progress(channel_name, download_stats, download_queue, elapsed):
+    rate = download_stats["bytes"] / elapsed if elapsed > 0 else 0.0
+    logging.info(
+        f"[{channel_name}] images: {download_stats['images']} downloaded "
+        f"({download_stats['deduplicated']} duplicates, {download_stats['skipped']} already stored), "
+        f"{download_stats['failed']} failed, {download_stats['write_failed']} not written, "
+        f"{download_stats['bytes'] / 1_048_576:.1f} MiB at {rate / 1024:.1f} KiB/s, "
+        f"queue depth {download_queue.qsize()}/{download_queue.maxsize}"
+    )
+
+async def flood_wait(seconds, semaphore=None):
+    """Sleeps out a FloodWait; the caller's concurrency slot goes to another channel meanwhile."""
+    if semaphore is None:
+        await asyncio.sleep(seconds)
+        return
+    semaphore.release()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await semaphore.acquire()
+
+async def scrape_channel(client, channel_entity, writer, image_store=None, limit=None, day=None, semaphore=None):
+    """
+    Scrapes a channel incrementally from its checkpoint, or, when day (a date) is given,
+    re-scrapes just that day's messages without touching the checkpoint (partition backfills).
+    Returns the scraped messages and whether the pass completed and was written.
+    writer and image_store are shared by all channels of the process and stay open afterwards.
+    semaphore is the concurrency slot the caller holds; it is released during FloodWait sleeps.
+    """
     channel_name = channel_entity.username if channel_entity.username else str(channel_entity.id)
-    logging.info(f"Scraping channel: {channel_name} (ID: {channel_entity.id})")
+    logging.info(f"Scraping channel: {channel_name} (ID: {channel_entity.id})" + (f" for {day}" if day else ""))
 
     all_messages_data = []
     messages_downloaded = 0
 
+    last_message_id = 0  # lowest id seen so far; iter_messages walks newest -> oldest
+    flood_retries = 0
+    completed = False
+
+    # Resume from the channel's high-water mark; with a refresh window we walk back past it
+    # until messages are older than the window, so recent posts get fresh view counts
+    high_water_mark = 0 if FULL_CRAWL or day else load_checkpoints().get(channel_name, {}).get("last_message_id", 0)
+    newest_message_id = high_water_mark
+    refresh_cutoff = None
+    min_id = high_water_mark
+    # Day mode: start just after the day ends and stop at the first message from before it
+    day_start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc) if day else None
+    offset_date = day_start + timedelta(days=1) if day else None
+    if high_water_mark and REFRESH_WINDOW_DAYS > 0:
+        refresh_cutoff = datetime.now(timezone.utc) - timedelta(days=REFRESH_WINDOW_DAYS)
+        min_id = 0
+    if high_water_mark:
+        logging.info(
+            f"Resuming {channel_name} after message {high_water_mark}"
+            + (f" (refreshing posts since {refresh_cutoff.date()})" if refresh_cutoff else "")
+        )
+
+    # Photos are downloaded by a worker pool fed from a bounded queue, so iteration only
+    # blocks (backpressure) when DOWNLOAD_QUEUE_SIZE downloads are already pending
+    download_queue = asyncio.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+    download_stats = new_download_stats()
+    download_start = time.monotonic()
+    download_workers = [
+        asyncio.create_task(photo_download_worker(client, download_queue, download_stats, writer, image_store))
+        for _ in range(DOWNLOAD_WORKERS)
+    ]
+
     try:
-        async for message in client.iter_messages(channel_entity, limit=limit):
-            message_date_str = message.date.strftime('%Y-%m-%d')
-            channel_data_path = os.path.join(DATA_LAKE_BASE_PATH, message_date_str, channel_name)
-            os.makedirs(channel_data_path, exist_ok=True)
-
-            # Build a lightweight JSON structure
-            message_data = {
-                "id": message.id,
-                "date": message.date.isoformat(),
-                "text": message.text,
-                "sender_id": message.sender_id,
-                "media_type": None,
-                "file_path": None
-            }
-
-            # Handle photo downloads
-            if message.photo:
-                image_date_path = os.path.join(IMAGES_BASE_PATH, message_date_str, channel_name)
-                os.makedirs(image_date_path, exist_ok=True)
-                image_filename = f"message_{message.id}_{message.photo.id}.jpg"
-                image_filepath = os.path.join(image_date_path, image_filename)
-                logging.info(f"Downloading image from message {message.id} to {image_filepath}")
-                try:
-                    await client.download_media(message.photo, file=image_filepath)
-                    message_data["media_type"] = "photo"
-                    message_data["file_path"] = image_filepath
-                except Exception as e:
-                    logging.error(f"Error downloading image from message {message.id}: {e}")
-
-            # Write individual JSON file
-            message_filepath = os.path.join(channel_data_path, f'{message.id}.json')
-            with open(message_filepath, 'w', encoding='utf-8') as f:
-                json.dump(message_data, f, ensure_ascii=False, indent=4)
-
-            all_messages_data.append(message_data)
-            messages_downloaded += 1
-
-            if messages_downloaded % 100 == 0:
-                logging.info(f"Downloaded {messages_downloaded} messages from {channel_name}")
+        while True:
+            remaining = None if limit is None else limit - messages_downloaded
+            try:
+                async for message in client.iter_messages(
+                    channel_entity, limit=remaining, offset_id=last_message_id, min_id=min_id, offset_date=offset_date
+                ):
+                    if refresh_cutoff and message.id <= high_water_mark and message.date < refresh_cutoff:
+                        break
+                    if day_start and message.date < day_start:
+                        break
+                    newest_message_id = max(newest_message_id, message.id)
 
-    except Exception as e:
-        logging.error(f"Error scraping channel {channel_name}: {e}")
+                    message_data = await write_message(writer, download_queue, message, channel_name)
+
+                    all_messages_data.append(message_data)
+                    messages_downloaded += 1
+                    last_message_id = message.id
+
+                    if messages_downloaded % 100 == 0:
+                        logging.info(f"Downloaded {messages_downloaded} messages from {channel_name}")
+                        log_download_progress(channel_name, download_stats, download_queue, time.monotonic() - download_start)
+
+                completed = True
+                break
+            except FloodWaitError as e:
+                # Back off only this channel; other channel tasks (including queued ones) run meanwhile
+                flood_retries += 1
+                if flood_retries > FLOOD_WAIT_MAX_RETRIES:
+                    logging.error(f"Giving up on {channel_name} after {FLOOD_WAIT_MAX_RETRIES} flood waits.")
+                    break
+                logging.warning(
+                    f"FloodWait on {channel_name}: sleeping {e.seconds}s "
+                    f"(retry {flood_retries}/{FLOOD_WAIT_MAX_RETRIES}, resuming below message {last_message_id})"
+                )
+                await flood_wait(e.seconds, semaphore)
+            except Exception as e:
+                logging.error(f"Error scraping channel {channel_name}: {e}")
+                break
+    finally:
+        # Drain pending downloads, then stop the workers
+        for _ in download_workers:
+            await download_queue.put(None)
+        await asyncio.gather(*download_workers)
+        log_download_progress(channel_name, download_stats, download_queue, time.monotonic() - download_start)
+
+    # This channel's rows must be written before its checkpoint moves past them
+    if download_stats["write_failed"]:
+        completed = False
+    if completed and not await flush_writer(writer):
+        completed = False  # keep the checkpoint so the next run re-fetches these messages
+
+    # Only advance the high-water mark after a complete pass, otherwise older gaps would be skipped
+    if completed and limit is None and day is None and newest_message_id > high_water_mark:
+        save_checkpoint(channel_name, newest_message_id)
+        logging.info(f"Checkpoint for {channel_name} advanced to message {newest_message_id}")
 
     # Write metadata summary file
     metadata = {
         "channel": channel_name,
         "scrape_date": datetime.now().isoformat(),
-        "messages_downloaded": messages_downloaded
+        "messages_downloaded": messages_downloaded,
+        "images_downloaded": download_stats["images"],
+        "output_format": OUTPUT_FORMAT,
+        "sink": SCRAPE_SINK
     }
-    metadata_path = os.path.join(DATA_LAKE_BASE_PATH, today_str, channel_name, "_scrape_metadata.json")
+    metadata_dir = day.isoformat() if day else today_str
+    metadata_path = os.path.join(DATA_LAKE_BASE_PATH, metadata_dir, channel_name, "_scrape_metadata.json")
     os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
     with open(metadata_path, 'w', encoding='utf-8') as f:
         json.dump(metadata, f, ensure_ascii=False, indent=4)
 
     logging.info(f"Finished scraping {messages_downloaded} messages from {channel_name}")
-    return all_messages_data
+    return all_messages_data, completed
 
-async def main():
-    client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+async def get_entity_with_backoff(client, channel_username, semaphore=None):
+    for attempt in range(1, FLOOD_WAIT_MAX_RETRIES + 2):
+        try:
+            return await client.get_entity(channel_username)
+        except FloodWaitError as e:
+            if attempt > FLOOD_WAIT_MAX_RETRIES:
+                raise
+            logging.warning(f"FloodWait resolving {channel_username}: sleeping {e.seconds}s (retry {attempt}/{FLOOD_WAIT_MAX_RETRIES})")
+            await flood_wait(e.seconds, semaphore)
+
+async def scrape_channel_task(client, channel_username, semaphore, writer, image_store):
+    """
+    Scrapes one channel under the shared semaphore and returns its timing stats. The slot is
+    given up while the channel sleeps out a FloodWait, so other channels keep scraping.
+    """
+    async with semaphore:
+        start = time.monotonic()
+        messages = []
+        status = "ok"
+        try:
+            entity = await get_entity_with_backoff(client, channel_username, semaphore)
+            messages, completed = await scrape_channel(client, entity, writer, image_store, semaphore=semaphore)
+            if not completed:
+                status = "incomplete"
+        except Exception as e:
+            status = f"failed: {e}"
+            logging.error(f"Could not get entity or scrape for channel {channel_username}: {e}")
+        return {
+            "channel": channel_username,
+            "messages": len(messages),
+            "elapsed": time.monotonic() - start,
+            "status": status,
+        }
 
-    logging.info("Starting Telegram client...")
-    await client.start()
-    logging.info("Telegram client started.")
+def log_scrape_summary(channel_stats, total_elapsed):
+    logging.info("Scrape summary:")
+    for stats in channel_stats:
+        rate = stats["messages"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+        logging.info(
+            f"  {stats['channel']}: {stats['messages']} messages in {stats['elapsed']:.1f}s "
+            f"({rate:.1f} msg/s) - {stats['status']}"
+        )
+    total_messages = sum(stats["messages"] for stats in channel_stats)
+    logging.info(f"  TOTAL: {total_messages} messages in {total_elapsed:.1f}s wall-clock")
 
+async def scrape_all_channels(client, writer=None, image_store=None):
+    """
+    Scrapes every configured channel concurrently on the shared client and returns per-channel stats.
+    All channels share one writer (one Postgres connection) and image store; when the caller passes
+    none, they are created here and closed at the end.
+    """
     # Ensure data directories exist
     os.makedirs(DATA_LAKE_BASE_PATH, exist_ok=True)
     os.makedirs(IMAGES_BASE_PATH, exist_ok=True)
 
-    for channel_username in TELEGRAM_CHANNELS:
+    owns_writer = writer is None
+    if owns_writer:
+        writer = create_writer()
+        image_store = create_image_store()
+
+    # Scrape channels concurrently on the shared client, bounded by SCRAPE_CONCURRENCY
+    semaphore = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+    logging.info(f"Scraping {len(TELEGRAM_CHANNELS)} channels with concurrency {SCRAPE_CONCURRENCY}")
+    run_start = time.monotonic()
+    try:
+        channel_stats = await asyncio.gather(
+            *(scrape_channel_task(client, channel_username, semaphore, writer, image_store)
+              for channel_username in TELEGRAM_CHANNELS)
+        )
+    finally:
+        if owns_writer:
+            if image_store:
+                image_store.close()
+            await close_writer(writer)
+    log_scrape_summary(channel_stats, time.monotonic() - run_start)
+    return channel_stats
+
+async def scrape_once():
+    """Connects, scrapes all channels once and disconnects. Used by the Dagster pipeline."""
+    async with session_lock():
+        client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+        await client.start()
         try:
-            entity = await client.get_entity(channel_username)
-            await scrape_channel(client, entity, limit=None)
-        except Exception as e:
-            logging.error(f"Could not get entity or scrape for channel {channel_username}: {e}")
-            # Optional: handle flood waits or retries here
+            return await scrape_all_channels(client)
+        finally:
+            await client.disconnect()
+
+async def scrape_partition(channel_username, day):
+    """
+    Scrapes one channel's messages for one day (a <date>/<channel> partition) and returns the count.
+    Parallel partition runs share the session, so they scrape one at a time (see session_lock).
+    """
+    async with session_lock():
+        client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+        await client.start()
+        writer = create_writer()
+        image_store = create_image_store()
+        try:
+            entity = await get_entity_with_backoff(client, channel_username)
+            messages, _ = await scrape_channel(client, entity, writer, image_store, day=day)
+        finally:
+            if image_store:
+                image_store.close()
+            written = await close_writer(writer)
+            await client.disconnect()
+    if not written:
+        raise RuntimeError(f"Messages of {channel_username} on {day} could not be written")
+    return len(messages)
+
+def listener_checkpoints(channels, newest_ids, unwritten):
+    """
+    Per channel, the highest message id the listener can vouch for once the writer is flushed:
+    just below the oldest photo post still downloading, otherwise the newest post received.
+    """
+    checkpoints = {}
+    for channel_name in channels:
+        if channel_name in newest_ids:
+            pending = unwritten.get(channel_name)
+            checkpoints[channel_name] = min(pending) - 1 if pending else newest_ids[channel_name]
+    return checkpoints
 
-    logging.info("All scraping tasks completed.")
-    await client.run_until_disconnected()
-    logging.info("Telegram client disconnected.")
+def advance_checkpoints(candidates):
+    checkpoints = load_checkpoints()
+    for channel_name, message_id in candidates.items():
+        if message_id > checkpoints.get(channel_name, {}).get("last_message_id", 0):
+            save_checkpoint(channel_name, message_id)
+            logging.info(f"Checkpoint for {channel_name} advanced to message {message_id} by the listener")
+
+async def flush_and_checkpoint(writer, interval, channels, newest_ids, unwritten):
+    """
+    Flushes the writer every interval seconds so quiet channels still get bounded latency, then
+    advances the checkpoints of channels in channels past the posts that flush wrote.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        # Taken before flushing: every post counted here is already in the writer's buffer
+        candidates = listener_checkpoints(channels, newest_ids, unwritten)
+        if await flush_writer(writer):
+            advance_checkpoints(candidates)
+
+async def listen(client):
+    """
+    Long-running listener: NewMessage/MessageEdited events on the configured channels are
+    micro-batched into the writer, flushed at least every LISTEN_FLUSH_INTERVAL seconds.
+    Handlers are registered before the catch-up crawl so nothing posted meanwhile is missed; the
+    crawl shares the listener's writer and image store. Once a channel's catch-up completed, each
+    successful flush advances its checkpoint past the new posts written, so a restart doesn't re-crawl them.
+    """
+    entities = [await get_entity_with_backoff(client, channel_username) for channel_username in TELEGRAM_CHANNELS]
+    channel_names = {utils.get_peer_id(entity): entity.username or str(entity.id) for entity in entities}
+
+    writer = create_writer()
+    image_store = create_image_store()
+    newest_ids = {}  # channel -> newest NewMessage id received
+    unwritten = {}  # channel -> ids of new photo posts not yet handed to the writer
+    checkpointed_channels = set()  # filled once the catch-up crawl has covered everything before the listener
+
+    def on_written(channel_name, message_id):
+        unwritten.get(channel_name, set()).discard(message_id)
+
+    download_queue = asyncio.Queue(maxsize=DOWNLOAD_QUEUE_SIZE)
+    download_stats = new_download_stats()
+    download_workers = [
+        asyncio.create_task(photo_download_worker(client, download_queue, download_stats, writer, image_store, on_written))
+        for _ in range(DOWNLOAD_WORKERS)
+    ]
+    received = 0
+
+    async def on_message(event):
+        nonlocal received
+        channel_name = channel_names.get(event.chat_id, str(event.chat_id))
+        # MessageEdited.Event subclasses NewMessage.Event; edits don't move the high-water mark
+        if not isinstance(event, events.MessageEdited.Event):
+            newest_ids[channel_name] = max(newest_ids.get(channel_name, 0), event.message.id)
+            if event.message.photo:
+                unwritten.setdefault(channel_name, set()).add(event.message.id)
+        await write_message(writer, download_queue, event.message, channel_name)
+        received += 1
+        if received % 100 == 0:
+            logging.info(f"Listener received {received} new/edited messages")
+
+    client.add_event_handler(on_message, events.NewMessage(chats=entities))
+    client.add_event_handler(on_message, events.MessageEdited(chats=entities))
+    flush_task = asyncio.create_task(
+        flush_and_checkpoint(writer, LISTEN_FLUSH_INTERVAL, checkpointed_channels, newest_ids, unwritten)
+    )
+    logging.info(f"Listening for new posts on {len(entities)} channels (flush every {LISTEN_FLUSH_INTERVAL}s)")
+
+    try:
+        # Catch up on anything posted while we were offline. A channel whose crawl stopped early keeps
+        # its old checkpoint, so the listener must not move it past the gap either
+        channel_stats = await scrape_all_channels(client, writer, image_store)
+        checkpointed_channels.update(
+            channel_names[utils.get_peer_id(entity)]
+            for entity, stats in zip(entities, channel_stats) if stats["status"] == "ok"
+        )
+        await client.run_until_disconnected()
+    finally:
+        flush_task.cancel()
+        await asyncio.gather(flush_task, return_exceptions=True)  # a cancelled flush keeps its rows buffered
+        client.remove_event_handler(on_message)
+        for _ in download_workers:
+            await download_queue.put(None)
+        await asyncio.gather(*download_workers)
+        if image_store:
+            image_store.close()
+        candidates = listener_checkpoints(checkpointed_channels, newest_ids, unwritten)
+        if await close_writer(writer):
+            advance_checkpoints(candidates)
+        logging.info(f"Listener stopped after {received} messages, {download_stats['images']} images.")
+
+async def main():
+    async with session_lock():
+        client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
+
+        logging.info("Starting Telegram client...")
+        await client.start()
+        logging.info("Telegram client started.")
+
+        if SCRAPE_LISTEN:
+            await listen(client)
+            return
+
+        try:
+            await scrape_all_channels(client)
+            logging.info("All scraping tasks completed.")
+        finally:
+            await client.disconnect()
+            logging.info("Telegram client disconnected.")
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file